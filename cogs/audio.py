@@ -1,17 +1,48 @@
 # Audio utility functions.
+import asyncio
+import collections
+import json
+import os
 import pathlib
 import typing
 import random
 import logging
-from discord.ext import commands
+import time
+from discord.ext import commands, tasks
 import discord
 from enum import Enum
-import requests
+import aiohttp
+from plomcord.scheduler import TokenBucket
 
 # The directory where audio files are stored.
 AUDIO_DIRECTORY = pathlib.Path("audio")
 AUDIO_DIRECTORY.mkdir(parents=True, exist_ok=True)
 
+# Byte budget for the audio cache (default 1 GiB).
+AUDIO_CACHE_MAX_BYTES = int(os.environ.get("AUDIO_CACHE_MAX_BYTES", 1024 ** 3))
+
+# Eviction policy for the audio cache, "lru" or "lfu".
+AUDIO_CACHE_POLICY = os.environ.get("AUDIO_CACHE_POLICY", "lru")
+
+# Default playback volume (20%).
+DEFAULT_VOLUME = 0.20
+
+# Loudness normalization filter applied to every track.
+LOUDNORM_FILTER = "loudnorm=I=-16.0:TP=-1.0"
+
+# How many tracks after the current one to download and open ahead of time.
+PREFETCH_TRACKS = 2
+
+# Admission control for play_url, so chat spam can't build an endless queue.
+# Tracks each guild and each user may add: (burst, per seconds).
+GUILD_RATE_LIMIT = (6, 10.0)
+USER_RATE_LIMIT = (3, 10.0)
+# Most tracks waiting behind the current one. Priority tracks may go over.
+MAX_QUEUE_LENGTH = int(os.environ.get("AUDIO_MAX_QUEUE_LENGTH", 10))
+# A track that's already waiting is either dropped ("drop"), moved to the
+# back of the queue ("replace"), or queued again ("allow").
+DUPLICATE_POLICY = os.environ.get("AUDIO_DUPLICATE_POLICY", "drop")
+
 
 def volume_bar(volume):
     """ Returns an ASCII volume bar for the given volume. 
@@ -24,6 +55,8 @@ def volume_bar(volume):
 
 
 class AudioTrack():
+    __slots__ = ("name", "url", "position")
+
     def __init__(self, name=None, url=None) -> None:
         # The unique name/id of the track.
         self.name = name
@@ -34,23 +67,430 @@ class AudioTrack():
         
         # If the name is not specified, use the last part of the URL.
         if name is None and url is not None:
-            self.name = url.split('/')[-1].split('.')[0].strip(".mp3")
-
-    @property
-    def downloaded(self) -> bool:
-        """ Returns whether the track has been downloaded. """
-        return self.path.is_file()
+            self.name = url.split('/')[-1].split('.')[0]
 
     @property
     def path(self) -> pathlib.Path:
         """ Returns the path to the audio file. """
         return AUDIO_DIRECTORY / f"{self.name}.mp3"
+
+    @property
+    def opus_path(self) -> pathlib.Path:
+        """ Returns the path to the normalized Ogg/Opus version of the audio file. """
+        return AUDIO_DIRECTORY / f"{self.name}.ogg"
     
-    def download(self) -> None:
-        """ Downloads the audio file. """
-        if not self.downloaded:
-            with open(self.path, "wb") as f:
-                f.write(requests.get(self.url).content)
+    async def download(self, downloader, cache) -> None:
+        """ Downloads the audio file unless it's already cached. """
+        if cache.lookup(self.path.name):
+            return
+        await downloader.download(self.url, self.path)
+        cache.add(self.path.name)
+
+
+class AudioCacheEntry():
+    """ Bookkeeping for a single cached file. """
+    __slots__ = ("size", "last_access", "hits")
+
+    def __init__(self, size, last_access, hits=0) -> None:
+        self.size = size
+        self.last_access = last_access
+        self.hits = hits
+
+
+class AudioCache():
+    """ Keeps an in-memory index of the files in the audio directory.
+
+    The total size is kept under max_bytes by evicting the least recently used
+    ("lru") or least frequently used ("lfu") files. The index is persisted to a
+    manifest, and files added or deleted since the manifest was saved are appended
+    to a journal so a crash doesn't lose them. On load the index is checked against
+    the directory listing, which picks up stray files and drops missing ones.
+    """
+    def __init__(self, directory=AUDIO_DIRECTORY, max_bytes=AUDIO_CACHE_MAX_BYTES, policy=AUDIO_CACHE_POLICY) -> None:
+        self.directory = pathlib.Path(directory)
+        self.manifest_path = self.directory / "manifest.json"
+        self.journal_path = self.directory / "manifest.journal"
+        self.max_bytes = max_bytes
+        self.policy = policy
+        # Cached files by name, ordered from least to most recently used.
+        self.entries: typing.OrderedDict[str, AudioCacheEntry] = collections.OrderedDict()
+        # Total size of the cached files in bytes.
+        self.total_bytes = 0
+        # Number of times each track has been played, kept even after eviction.
+        self.plays: typing.Counter[str] = collections.Counter()
+        # Counters.
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Whether the index has changed since the manifest was saved.
+        self.dirty = False
+        self.load()
+
+    def __contains__(self, name) -> bool:
+        """ Returns whether a file is cached, without recording an access. """
+        return name in self.entries
+
+    def lookup(self, name) -> bool:
+        """ Returns whether a file is cached, and records the access. """
+        entry = self.entries.get(name)
+        if entry is None:
+            self.misses += 1
+            return False
+        self.hits += 1
+        entry.hits += 1
+        entry.last_access = time.time()
+        self.entries.move_to_end(name)
+        self.dirty = True
+        return True
+
+    def add(self, name) -> None:
+        """ Adds a file that was just written to the audio directory. """
+        size = (self.directory / name).stat().st_size
+        old_entry = self.entries.pop(name, None)
+        if old_entry is not None:
+            self.total_bytes -= old_entry.size
+        self.entries[name] = AudioCacheEntry(size, time.time())
+        self.total_bytes += size
+        self.dirty = True
+        self.journal("add", name, size, self.entries[name].last_access)
+        self.evict(protect=name)
+
+    def record_play(self, track_name) -> None:
+        """ Counts a play of a track. """
+        self.plays[track_name] += 1
+        self.dirty = True
+
+    def most_played(self, n) -> typing.List[str]:
+        """ Returns the names of the n most played tracks. """
+        return [name for name, _ in self.plays.most_common(n)]
+
+    @property
+    def full(self) -> bool:
+        """ Returns whether the cache is close to its budget. """
+        return self.total_bytes >= self.max_bytes * 0.95
+
+    def remove(self, name) -> None:
+        """ Deletes a file from the cache. """
+        entry = self.entries.pop(name, None)
+        if entry is not None:
+            self.total_bytes -= entry.size
+            (self.directory / name).unlink(missing_ok=True)
+            self.dirty = True
+            self.journal("remove", name)
+
+    def evict(self, protect=None) -> None:
+        """ Deletes files until the cache fits in its budget. """
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            name = self.pick_victim(protect)
+            entry = self.entries.pop(name)
+            self.total_bytes -= entry.size
+            (self.directory / name).unlink(missing_ok=True)
+            self.evictions += 1
+            self.dirty = True
+            self.journal("remove", name)
+            logging.debug(f"Evicted {name} from the audio cache ({entry.size} bytes)")
+
+    def pick_victim(self, protect=None) -> str:
+        """ Returns the name of the next file to evict. """
+        candidates = (name for name in self.entries if name != protect)
+        if self.policy == "lfu":
+            return min(candidates, key=lambda name: (self.entries[name].hits, self.entries[name].last_access))
+        # Least recently used is at the front of the ordered dict.
+        return next(candidates)
+
+    def journal(self, *change) -> None:
+        """ Appends a change to the journal, so it isn't lost if the bot stops before the next save. """
+        with open(self.journal_path, "a") as f:
+            f.write(json.dumps(change) + "\n")
+
+    def load(self) -> None:
+        """ Loads the index from the manifest and journal, then checks it against the directory. """
+        try:
+            with open(self.manifest_path, "r") as f:
+                manifest = json.load(f)
+            rows = sorted(manifest["entries"].items(), key=lambda row: row[1][1])
+            self.plays.update(manifest.get("plays", {}))
+        except (FileNotFoundError, ValueError, KeyError):
+            # No usable manifest - the index is rebuilt from the directory below.
+            logging.info(f"Rebuilding audio cache index from {self.directory}")
+            rows = []
+            self.dirty = True
+
+        for name, (size, last_access, hits) in rows:
+            self.entries[name] = AudioCacheEntry(size, last_access, hits)
+        self.replay_journal()
+        self.reconcile()
+        self.total_bytes = sum(entry.size for entry in self.entries.values())
+        logging.info(f"Audio cache: {len(self.entries)} files, {self.total_bytes} bytes")
+
+        # The budget may have shrunk since the last run.
+        self.evict()
+        self.save()
+
+    def save(self) -> None:
+        """ Writes the index to the manifest if it changed. """
+        if not self.dirty:
+            return
+        manifest = {
+            "version": 1,
+            "entries": {name: (e.size, e.last_access, e.hits) for name, e in self.entries.items()},
+            "plays": self.plays,
+        }
+        temp_path = self.manifest_path.with_name(f"{self.manifest_path.name}.part")
+        with open(temp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(temp_path, self.manifest_path)
+        # The manifest has every change now. Replaying the journal twice is harmless if this doesn't happen.
+        self.journal_path.unlink(missing_ok=True)
+        self.dirty = False
+
+    def replay_journal(self) -> None:
+        """ Applies the changes made since the manifest was last saved. """
+        try:
+            f = open(self.journal_path, "r")
+        except FileNotFoundError:
+            return
+        with f:
+            for line in f:
+                try:
+                    change = json.loads(line)
+                except ValueError:
+                    # The last line may have been cut off by a crash.
+                    break
+                name = change[1]
+                self.entries.pop(name, None)
+                if change[0] == "add":
+                    self.entries[name] = AudioCacheEntry(change[2], change[3])
+        self.dirty = True
+
+    def reconcile(self) -> None:
+        """ Adds audio files the index doesn't know about, and drops entries whose files are gone. """
+        on_disk = {entry.name: entry for entry in os.scandir(self.directory)
+                   if entry.name.endswith((".mp3", ".ogg"))}
+
+        missing = [name for name in self.entries if name not in on_disk]
+        for name in missing:
+            del self.entries[name]
+
+        # Stray files go in oldest first, so they're evicted in the order they were written.
+        strays = sorted(((name, entry.stat()) for name, entry in on_disk.items() if name not in self.entries),
+                        key=lambda stray: stray[1].st_mtime)
+        for name, stat in strays:
+            self.entries[name] = AudioCacheEntry(stat.st_size, stat.st_mtime)
+
+        if missing or strays:
+            logging.info(f"Audio cache: dropped {len(missing)} missing files, added {len(strays)} untracked files")
+            self.dirty = True
+
+    def stats(self) -> dict:
+        """ Returns the cache counters. """
+        return {
+            "files": len(self.entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class AudioDownloader():
+    """ Downloads audio files without blocking the event loop.
+
+    Every download goes through one shared, connection-pooled HTTP session.
+    Files are streamed to a temporary file and renamed into place once complete,
+    so a half-written file is never played. Concurrent requests for the same URL
+    share a single download.
+    """
+    def __init__(self, max_connections=16, timeout=30, retries=3) -> None:
+        # Maximum number of open connections in the pool.
+        self.max_connections = max_connections
+        # Timeout for a single attempt, in seconds.
+        self.timeout = aiohttp.ClientTimeout(total=timeout, sock_connect=10)
+        # Number of attempts before giving up on a download.
+        self.retries = retries
+        # The shared HTTP session, created on first use.
+        self.session = None
+        # Downloads in progress, keyed by URL.
+        self.in_flight: typing.Dict[str, asyncio.Task] = {}
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        """ Returns the shared HTTP session, creating it if needed. """
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_connections, ttl_dns_cache=300)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self.session
+
+    async def close(self) -> None:
+        """ Closes the shared HTTP session. """
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def download(self, url, path: pathlib.Path) -> pathlib.Path:
+        """ Downloads a URL to the given path. Joins the download if it's already running. """
+        task = self.in_flight.get(url)
+        if task is None:
+            task = asyncio.ensure_future(self._download(url, path))
+            self.in_flight[url] = task
+            task.add_done_callback(lambda _: self.in_flight.pop(url, None))
+
+        # Shield the shared download so one cancelled waiter doesn't cancel it for everyone.
+        return await asyncio.shield(task)
+
+    async def _download(self, url, path: pathlib.Path) -> pathlib.Path:
+        """ Downloads a URL, retrying with exponential backoff. """
+        for attempt in range(1, self.retries + 1):
+            try:
+                await self._fetch(url, path)
+                return path
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                # Client errors like 404 won't go away, only retry rate limits and server errors.
+                if isinstance(error, aiohttp.ClientResponseError) and error.status != 429 and error.status < 500:
+                    raise
+                if attempt == self.retries:
+                    raise
+                delay = 0.5 * 2 ** (attempt - 1)
+                logging.warning(f"Download of {url} failed ({error}), retrying in {delay}s")
+                await asyncio.sleep(delay)
+
+    async def _fetch(self, url, path: pathlib.Path) -> None:
+        """ Streams a URL into a temporary file, then renames it into place. """
+        session = await self.get_session()
+        temp_path = path.with_name(f"{path.name}.part")
+        try:
+            async with session.get(url) as response:
+                response.raise_for_status()
+                with open(temp_path, "wb") as f:
+                    async for chunk in response.content.iter_chunked(64 * 1024):
+                        f.write(chunk)
+            # Atomic on POSIX and Windows, so readers never see a partial file.
+            os.replace(temp_path, path)
+        finally:
+            temp_path.unlink(missing_ok=True)
+
+
+class AudioTranscoder():
+    """ Normalizes and encodes audio files to Ogg/Opus in the background.
+
+    Playing a pre-transcoded file skips the per-play loudnorm pass, and the Opus
+    packets are sent as-is instead of being re-encoded by the voice client. The
+    default volume is baked into the file, so players at the default volume can
+    pass it straight through.
+    """
+    def __init__(self, cache, max_processes=2, volume=DEFAULT_VOLUME, bitrate="96k") -> None:
+        self.cache = cache
+        self.volume = volume
+        self.bitrate = bitrate
+        # Limits the number of FFmpeg processes running at once.
+        self.semaphore = asyncio.Semaphore(max_processes)
+        # Transcodes in progress, keyed by output file name.
+        self.in_flight: typing.Dict[str, asyncio.Task] = {}
+
+    def schedule(self, track: AudioTrack) -> typing.Optional[asyncio.Task]:
+        """ Transcodes a downloaded track in the background if it isn't already.
+            Returns the transcode's task (shared with any earlier caller), or None if the track is already transcoded.
+        """
+        name = track.opus_path.name
+        if name in self.cache:
+            return None
+        if name in self.in_flight:
+            return self.in_flight[name]
+        task = asyncio.ensure_future(self.transcode(track.path, track.opus_path))
+        self.in_flight[name] = task
+        task.add_done_callback(lambda _: self.in_flight.pop(name, None))
+        return task
+
+    async def transcode(self, source: pathlib.Path, destination: pathlib.Path) -> bool:
+        """ Normalizes and encodes source into destination. Returns True on success. """
+        temp_path = destination.with_name(f"{destination.name}.part")
+        async with self.semaphore:
+            process = await asyncio.create_subprocess_exec(
+                "ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+                "-i", str(source),
+                "-af", f"{LOUDNORM_FILTER},volume={self.volume}",
+                "-c:a", "libopus", "-b:a", self.bitrate, "-ar", "48000", "-ac", "2",
+                "-f", "ogg", str(temp_path),
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            _, stderr = await process.communicate()
+
+        if process.returncode != 0:
+            logging.error(f"Failed to transcode {source}: {stderr.decode(errors='replace').strip()}")
+            temp_path.unlink(missing_ok=True)
+            return False
+
+        os.replace(temp_path, destination)
+        self.cache.add(destination.name)
+        # The original file is no longer needed.
+        self.cache.remove(source.name)
+        return True
+
+
+def most_played_urls(urls, cache, top) -> typing.List[str]:
+    """ Returns the URLs of the top most played tracks, most played first.
+        Without enough play history (e.g. on a new host), the rest are taken in the order given.
+    """
+    names = {url: AudioTrack(url=url).name for url in dict.fromkeys(urls)}
+    ranks = {name: rank for rank, name in enumerate(cache.most_played(top))}
+    played = sorted((url for url, name in names.items() if name in ranks), key=lambda url: ranks[names[url]])
+    if len(played) < top:
+        logging.warning(f"Only {len(played)} of the top {top} tracks have been played, "
+                        f"taking the next {top - len(played)} in order")
+        played += [url for url, name in names.items() if name not in ranks][:top - len(played)]
+    return played
+
+
+async def prewarm(urls, downloader, cache, transcoder=None, concurrency=8, progress=None) -> dict:
+    """ Downloads every URL that isn't cached yet, and transcodes it if a transcoder is given.
+
+    Tracks that are already cached are skipped, so an interrupted run picks up where it
+    left off. Stops early once the cache is full so prewarming doesn't evict tracks that
+    were actually played. progress(counts) is called after each track.
+    Returns the counts: total, skipped, fetched and failed.
+    """
+    tracks = [AudioTrack(url=url) for url in dict.fromkeys(urls)]
+
+    def cached(track):
+        if track.opus_path.name in cache:
+            return True
+        return transcoder is None and track.path.name in cache
+
+    pending = iter([track for track in tracks if not cached(track)])
+    counts = {"total": len(tracks), "skipped": 0, "fetched": 0, "failed": 0}
+    counts["skipped"] = counts["total"] - sum(1 for track in tracks if not cached(track))
+
+    async def worker():
+        for track in pending:
+            if cache.full:
+                logging.warning("Audio cache is full, stopping prewarm")
+                return
+            try:
+                if track.path.name not in cache:
+                    await downloader.download(track.url, track.path)
+                    cache.add(track.path.name)
+                # Go through schedule() so a track that's also being played isn't transcoded twice.
+                task = transcoder.schedule(track) if transcoder is not None else None
+                if task is not None and not await task:
+                    counts["failed"] += 1
+                else:
+                    counts["fetched"] += 1
+            except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as error:
+                logging.warning(f"Failed to prewarm {track.url}: {error}")
+                counts["failed"] += 1
+
+            # Checkpoint the cache index so progress survives a restart.
+            if (counts["fetched"] + counts["failed"]) % 100 == 0:
+                cache.save()
+            if progress is not None:
+                progress(counts)
+
+    # Each worker pulls from the same iterator, so at most `concurrency` tracks are in flight.
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    cache.save()
+    return counts
 
 
 class AudioQueue():
@@ -83,6 +523,18 @@ class AudioQueue():
         if self.repeat == "all" and self.position >= len(self.tracks):
             self.position = 0
 
+    def upcoming(self, count) -> typing.List[AudioTrack]:
+        """ Returns up to count tracks after the current one. """
+        return self.tracks[self.position + 1:self.position + 1 + count]
+
+    def remove_upcoming(self, name) -> typing.List[AudioTrack]:
+        """ Removes the tracks with this name after the current one. Returns the removed tracks. """
+        upcoming = self.tracks[self.position + 1:]
+        removed = [track for track in upcoming if track.name == name]
+        if removed:
+            self.tracks[self.position + 1:] = [track for track in upcoming if track.name != name]
+        return removed
+
     def add(self, tracks: typing.List[AudioTrack], play_next=False):
         """ Adds a list of tracks to the queue. """
         for i, track in enumerate(tracks):
@@ -105,6 +557,110 @@ class AudioQueue():
             random.shuffle(temp_tracks)
             self.tracks[self.position + 1:] = temp_tracks
 
+class TimedAudioSource(discord.AudioSource):
+    """ Wraps an audio source to measure the time from a track being due to its first audio. """
+
+    def __init__(self, original, track, requested, times) -> None:
+        self.original = original
+        self.track = track
+        # When the track became due to play (time.perf_counter()).
+        self.requested = requested
+        # Where to record the result. Appended to from the player thread.
+        self.times = times
+        self.started = False
+
+    def read(self) -> bytes:
+        data = self.original.read()
+        if not self.started:
+            self.started = True
+            elapsed = time.perf_counter() - self.requested
+            self.times.append(elapsed)
+            logging.info(f"Time to first audio for {self.track.name}: {elapsed * 1000:.0f}ms")
+        return data
+
+    def is_opus(self) -> bool:
+        return self.original.is_opus()
+
+    def cleanup(self) -> None:
+        self.original.cleanup()
+
+class AudioAdmission():
+    """ Decides whether a requested track may join a guild's queue.
+
+    Each guild and each user gets a token bucket, the queue has a maximum
+    length (which priority tracks may go over), and duplicates of a track
+    that's already waiting are dropped or replaced. Rejections are counted
+    by reason.
+    """
+
+    def __init__(self, guild_rate=GUILD_RATE_LIMIT, user_rate=USER_RATE_LIMIT,
+                 max_queue_length=MAX_QUEUE_LENGTH, duplicates=DUPLICATE_POLICY) -> None:
+        self.guild_rate = guild_rate
+        self.user_rate = user_rate
+        self.max_queue_length = max_queue_length
+        self.duplicates = duplicates
+        # Guild id / user id -> TokenBucket.
+        self.guild_buckets = {}
+        self.user_buckets = {}
+        # Reason -> number of tracks rejected for it.
+        self.rejections = collections.Counter()
+        self.admitted = 0
+
+    def bucket(self, buckets, key, rate) -> TokenBucket:
+        """ Returns the bucket for a guild or user, creating it if needed. """
+        bucket = buckets.get(key)
+        if bucket is None:
+            # Forget buckets that have refilled, so they don't pile up.
+            if len(buckets) >= 10000:
+                for old_key, old_bucket in list(buckets.items()):
+                    old_bucket.refill()
+                    if old_bucket.tokens >= old_bucket.capacity:
+                        del buckets[old_key]
+            bucket = buckets[key] = TokenBucket(*rate)
+        return bucket
+
+    def admit(self, player, track, user_id=None, priority=False) -> bool:
+        """ Returns True if the track may be queued on the player. May remove a pending duplicate. """
+        upcoming = player.queue.upcoming(len(player.queue.tracks))
+
+        # Duplicates of a track that's already waiting.
+        duplicate = any(pending.name == track.name for pending in upcoming)
+        if duplicate and self.duplicates == "drop":
+            return self.reject("duplicate")
+
+        # Full queue, unless this track is allowed to jump it.
+        waiting = len(upcoming) - (duplicate and self.duplicates == "replace")
+        if waiting >= self.max_queue_length and not priority:
+            return self.reject("queue_full")
+
+        # Rate limits, per user then per guild. Give the user's token back if the guild is out.
+        user_bucket = None
+        if user_id is not None:
+            user_bucket = self.bucket(self.user_buckets, user_id, self.user_rate)
+            if not user_bucket.try_acquire():
+                return self.reject("user_rate")
+        if not self.bucket(self.guild_buckets, player.guild, self.guild_rate).try_acquire():
+            if user_bucket is not None:
+                user_bucket.tokens += 1
+            return self.reject("guild_rate")
+
+        # Admitted. Take the old copy of a duplicate out of the queue.
+        if duplicate and self.duplicates == "replace":
+            for removed in player.queue.remove_upcoming(track.name):
+                player.discard(removed)
+        self.admitted += 1
+        return True
+
+    def reject(self, reason) -> bool:
+        """ Counts a rejection. Always returns False. """
+        self.rejections[reason] += 1
+        logging.debug(f"Rejected track: {reason}")
+        return False
+
+    def stats(self) -> dict:
+        """ Returns the number of tracks admitted and rejected (by reason). """
+        return {"admitted": self.admitted, "rejected": dict(self.rejections)}
+
 class AudioPlayerStatus(Enum):
     PLAYING = 1
     PAUSED = 2
@@ -120,23 +676,38 @@ class AudioPlayer():
         # The voice client to play audio through.
         self.voice_client = None
         # The volume of the audio player.
-        self.volume = 0.20  # 20%
+        self.volume = DEFAULT_VOLUME
+        # Extra gain applied to the current source (pre-transcoded files have the default volume baked in).
+        self.source_gain = 1.0
         # The current status of the player.
         self.status = AudioPlayerStatus.STOPPED
+        # Track -> task downloading it and opening its audio source, for the current and next tracks.
+        self.prepared = {}
+        # Seconds from each track being due to its first audio, most recent last.
+        self.first_audio_times = collections.deque(maxlen=100)
 
     async def connect(self, voice_channel: discord.VoiceChannel) -> discord.VoiceClient:
         """ Connects or moves to a voice channel. """
-        if self.voice_client:
-            await self.voice_client.move_to(voice_channel)
+        if self.voice_client and self.voice_client.is_connected():
+            if self.voice_client.channel != voice_channel:
+                await self.voice_client.move_to(voice_channel)
         else:
+            # Reconnect if the old voice client was disconnected (e.g. by stop()).
             self.voice_client = await voice_channel.connect()
                 
     async def play(self, voice_channel: discord.VoiceChannel) -> None:
         """ Starts playback in the given voice channel. """
+        # If there is no track, stop the player. Checked before connecting so a
+        # stop() (which clears the queue and disconnects) doesn't rejoin the channel.
+        if self.queue.current_track is None:
+            self.status = AudioPlayerStatus.STOPPED
+            return
+
         await self.connect(voice_channel)
         
-        # If the player is already playing, do nothing.
+        # If the player is already playing, just get the new tracks ready.
         if self.status == AudioPlayerStatus.PLAYING:
+            self.prefetch()
             return
         
         # If the player is paused, just resume.
@@ -144,49 +715,143 @@ class AudioPlayer():
             self.voice_client.resume()
             return
         
-        # If there is no track, stop the player.
-        if self.queue.current_track is None:
-            self.status = AudioPlayerStatus.STOPPED
-            return
-        
         # Set the status to playing.
         self.status = AudioPlayerStatus.PLAYING
+        requested = time.perf_counter()
 
-        # Make sure the track is downloaded.
-        self.queue.current_track.download()
-
-        # Set up FFMPEG options.
-        # -ss skips ahead to the current position in the track.
-        # -af loudnorm normalizes the audio.
-        ffmpeg_options = f"-ss {self.queue.current_track.position} -af loudnorm=I=-16.0:TP=-1.0"
-        
-        # Create the audio source.
-        audio_source = discord.FFmpegPCMAudio(source=self.queue.current_track.path, options=ffmpeg_options)
-        audio_source = discord.PCMVolumeTransformer(audio_source, volume=self.volume)
+        # Get the next tracks ready while this one loads and plays.
+        self.prefetch()
 
-        def next_track(err=None):
-            # Set the status to stopped before moving on.
+        # Wait for the track's source. Usually it was prefetched while the last track played.
+        track = self.queue.current_track
+        try:
+            audio_source, source_gain = await self.prepare(track)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            # Skip tracks that can't be downloaded.
+            logging.error(f"Failed to download {track.url}: {error}")
             self.status = AudioPlayerStatus.STOPPED
-            # Move on the the next track in the queue.
             self.queue.increment_position()
-            self.bot.loop.create_task(self.play(voice_channel))
+            return await self.play(voice_channel)
+        finally:
+            self.prepared.pop(track, None)
+
+        # The queue may have been cleared or the bot disconnected while downloading.
+        if self.queue.current_track is not track or not self.voice_client.is_connected():
+            audio_source.cleanup()
+            self.status = AudioPlayerStatus.STOPPED
+            return
+
+        # Opus is passed through at the default volume, so reopen it if the volume changed since.
+        if audio_source.is_opus() and self.volume != DEFAULT_VOLUME:
+            audio_source.cleanup()
+            audio_source, source_gain = self.create_source(track)
+        elif isinstance(audio_source, discord.PCMVolumeTransformer):
+            audio_source.volume = self.volume * source_gain
+        self.source_gain = source_gain
+        self.bot.audio.cache.record_play(track.name)
+
+        def next_track(err=None):
+            # This runs in the voice client's player thread, so hand over to the event loop.
+            self.bot.loop.call_soon_threadsafe(self.track_finished, voice_channel, track, err)
         
         # Begin playback.
-        self.voice_client.play(audio_source, after=next_track)
+        self.voice_client.play(TimedAudioSource(audio_source, track, requested, self.first_audio_times),
+                               after=next_track)
+
+    def track_finished(self, voice_channel, track, err=None) -> None:
+        """ Moves on to the next track. Called on the event loop when a track ends. """
+        if err is not None:
+            logging.error(f"Playback error: {err}")
+        # Ignore tracks cut off by stop(). The queue was cleared, and moving on would rejoin the channel.
+        if self.queue.current_track is not track:
+            return
+        # Set the status to stopped before moving on.
+        self.status = AudioPlayerStatus.STOPPED
+        # Move on the the next track in the queue, if there is one.
+        self.queue.increment_position()
+        if self.queue.current_track is None:
+            return
+        asyncio.ensure_future(self.play(voice_channel))
+
+    def prepare(self, track: AudioTrack) -> asyncio.Task:
+        """ Returns the task getting a track's audio source ready, starting it if needed. """
+        task = self.prepared.get(track)
+        if task is None:
+            task = self.prepared[track] = asyncio.ensure_future(self.open_source(track))
+        return task
+
+    def prefetch(self) -> None:
+        """ Downloads and opens the next few tracks ahead of time, so they start without a gap. """
+        for track in self.queue.upcoming(PREFETCH_TRACKS):
+            self.prepare(track)
+
+    async def open_source(self, track: AudioTrack) -> tuple:
+        """ Downloads a track unless it's already transcoded, and opens its audio source. """
+        cache = self.bot.audio.cache
+        # Record one cache access per play: the transcoded file if there is one, otherwise the download.
+        if track.opus_path.name in cache:
+            cache.lookup(track.opus_path.name)
+        else:
+            await track.download(self.bot.audio.downloader, cache)
+        return self.create_source(track)
+
+    def discard(self, track: AudioTrack) -> None:
+        """ Cancels prefetching a track, closing its audio source if it was already opened. """
+        task = self.prepared.pop(track, None)
+        if task is None:
+            return
+        if not task.done():
+            task.cancel()
+        elif not task.cancelled() and task.exception() is None:
+            task.result()[0].cleanup()
+
+    def discard_prepared(self) -> None:
+        """ Cancels prefetching and closes any audio sources that were opened ahead of time. """
+        for track in list(self.prepared):
+            self.discard(track)
+
+    def create_source(self, track: AudioTrack) -> tuple:
+        """ Creates the audio source for a track, preferring the pre-transcoded Opus file.
+            Returns the source and the gain applied on top of the volume.
+        """
+        # -ss skips ahead to the current position in the track.
+        seek = f"-ss {track.position}"
+
+        if track.opus_path.name in self.bot.audio.cache:
+            # At the default volume, the Opus packets can be sent as-is.
+            if self.volume == DEFAULT_VOLUME:
+                return discord.FFmpegOpusAudio(source=str(track.opus_path), codec="copy", options=seek), 1.0
+
+            # Otherwise decode it, but there's no need to normalize it again.
+            # The file already has the default volume applied.
+            source_gain = 1 / DEFAULT_VOLUME
+            audio_source = discord.FFmpegPCMAudio(source=track.opus_path, options=seek)
+            return discord.PCMVolumeTransformer(audio_source, volume=self.volume * source_gain), source_gain
+
+        # Not transcoded yet - normalize on the fly and transcode it for next time.
+        self.bot.audio.transcoder.schedule(track)
+        audio_source = discord.FFmpegPCMAudio(source=track.path, options=f"{seek} -af {LOUDNORM_FILTER}")
+        return discord.PCMVolumeTransformer(audio_source, volume=self.volume), 1.0
 
     def set_volume(self, volume):
         """ Sets the volume in range [0,100] """
-        self.volume = max(min(100, volume), 0)
+        volume = max(min(100, volume), 0)
+        self.volume = volume / 100.0
 
-        # Change current volume if playing.
-        if self.voice_client and self.voice_client.source:
-            self.voice_client.source.volume = self.volume / 100.0
+        # Change current volume if playing. Opus passthrough sources keep the
+        # default volume until the next track.
+        source = self.voice_client.source if self.voice_client else None
+        if isinstance(source, TimedAudioSource):
+            source = source.original
+        if isinstance(source, discord.PCMVolumeTransformer):
+            source.volume = self.volume * self.source_gain
 
-        return self.volume
+        return volume
     
     async def stop(self) -> None:
         """ Clear the queue and stop playback. """
         self.queue.clear()
+        self.discard_prepared()
         if self.voice_client:
             await self.voice_client.disconnect(force=True)
         self.status = AudioPlayerStatus.STOPPED
@@ -196,8 +861,38 @@ class AudioCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.bot.audio = self
-        self.audio_players = {}        
+        self.audio_players = {}
+        # Shared downloader used by every audio player.
+        self.downloader = AudioDownloader()
+        # Index of the audio files on disk.
+        self.cache = AudioCache()
+        # Background normalizer that fills the Opus cache.
+        self.transcoder = AudioTranscoder(self.cache)
+        # Limits on what can be queued.
+        self.admission = AudioAdmission()
+        self.save_cache_manifest.start()
+
+    def cog_unload(self):
+        """ Saves the cache index and closes the shared HTTP session when the cog is unloaded. """
+        self.save_cache_manifest.cancel()
+        self.cache.save()
+        self.bot.loop.create_task(self.downloader.close())
+
+    @tasks.loop(minutes=5)
+    async def save_cache_manifest(self):
+        """ Periodically persists the audio cache index. """
+        self.cache.save()
+        logging.debug(f"Audio cache stats: {self.cache.stats()}")
+        logging.debug(f"Audio admission stats: {self.admission.stats()}")
     
+    async def prewarm(self, urls, top=None, normalize=False, concurrency=8, progress=None) -> dict:
+        """ Fills the cache ahead of time. If top is given, only the top most played tracks are fetched. """
+        if top is not None:
+            urls = most_played_urls(urls, self.cache, top)
+        transcoder = self.transcoder if normalize else None
+        return await prewarm(urls, self.downloader, self.cache, transcoder=transcoder,
+                             concurrency=concurrency, progress=progress)
+
     def user_in_voice_channel(self, user):
         """ Returns True if the user is in a voice channel. """
         try:
@@ -213,19 +908,29 @@ class AudioCog(commands.Cog):
             self.audio_players[guild_id] = AudioPlayer(self.bot, guild_id)
         return self.audio_players[guild_id]
     
-    async def play_url(self, url, voice_channel) -> None:
-        """ Plays audio from a given URL in a voice channel. """
+    def play_url(self, url, voice_channel, user=None, priority=False) -> bool:
+        """ Plays audio from a given URL in a voice channel.
+            Priority tracks play next and may go over the queue length limit.
+            Returns False if the track was rejected by admission control. Returns right away
+            otherwise; connecting and downloading happen in the background.
+        """
         # Get the audio player for the server.
         audio_player = self.get_audio_player(voice_channel.guild.id)
         
         # Create the audio track.
         audio_track = AudioTrack(url=url)
+
+        # Make sure there's room for it.
+        user_id = user.id if user is not None else None
+        if not self.admission.admit(audio_player, audio_track, user_id=user_id, priority=priority):
+            return False
         
         # Add the track to the queue.
-        audio_player.queue.add([audio_track])
+        audio_player.queue.add([audio_track], play_next=priority)
         
-        # Play the audio.
-        await audio_player.play(voice_channel)
+        # Play the audio without making the caller wait for it.
+        asyncio.ensure_future(audio_player.play(voice_channel))
+        return True
 
     @discord.commands.slash_command(name="volume", description="Set the volume", guild_ids=[708529166693171331, 575720006697091106, 408172061723459584, 886749702102597662])
     async def volume(self, ctx, volume: discord.commands.Option(int, "New volume (0-100) (Default: 20)", required=False)):
@@ -0,0 +1,87 @@
+""" Measures how much memory the wiki cog's heroes take, per voice response.
+
+Compares plain classes (how the wiki cog used to store the data) with the
+slotted classes in cogs/wiki.py. The voice lines cog's exact match index is
+built too, since the bot always builds it at startup. Run from the repository root:
+    python dota/bench_wiki_memory.py
+    python dota/bench_wiki_memory.py --wiki path/to/dota_wiki.json
+"""
+import argparse
+import gc
+import json
+import sys
+import tracemalloc
+
+# hacky way to import the dota cogs
+sys.path.append(".")
+from dota.cogs import voice_lines, wiki
+
+
+class PlainAbility:
+    def __init__(self, data) -> None:
+        self.lore = data["lore"]
+        self.name = data["name"]
+        self.thumbnail = data["thumbnail"]
+        self.url = data["url"]
+
+class PlainHero:
+    def __init__(self, data) -> None:
+        self.abilities = [PlainAbility(ability) for ability in data["abilities"]]
+        self.name = data["_name"]
+        self.responses = [PlainVoiceResponse(response) for response in data["responses"]]
+        self.thumbnail = data["thumbnail"]
+        self.url = data["url"]
+        self.responses_url = f"{self.url}/Responses"
+
+class PlainVoiceResponse:
+    def __init__(self, data) -> None:
+        self.text = data["text"]
+        self.url = data["url"]
+
+
+def build_row_index(heroes) -> dict:
+    """ Builds the exact match index the way it used to be, with a full row per response. """
+    index = {}
+    for hero in heroes:
+        for response in hero.responses:
+            row = (hero.name, hero.responses_url, response.url, response.text, hero.thumbnail)
+            index.setdefault(voice_lines.normalize_text(response.text), []).append(row)
+    return index
+
+
+def measure(path, hero_class, build_index) -> int:
+    """ Returns the bytes still allocated after loading the heroes, indexing them and dropping the raw data. """
+    gc.collect()
+    tracemalloc.start()
+    with open(path, "rb") as f:
+        data = json.load(f)
+    heroes = [hero_class(hero) for hero in data["heroes"]]
+    del data
+    index = build_index(heroes)
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del heroes, index
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the memory used by the wiki heroes.")
+    parser.add_argument("--wiki", default="dota/dota_wiki.json", help="path to the scraped wiki data")
+    args = parser.parse_args()
+
+    with open(args.wiki, "rb") as f:
+        count = sum(len(hero["responses"]) for hero in json.load(f)["heroes"])
+
+    results = [
+        ("plain classes, row index", measure(args.wiki, PlainHero, build_row_index)),
+        ("slotted classes, row index", measure(args.wiki, wiki.Hero, build_row_index)),
+        ("slotted classes, reference index", measure(args.wiki, wiki.Hero, voice_lines.build_exact_index)),
+    ]
+    print(f"{count} responses")
+    for name, size in results:
+        print(f"{name + ':':34} {size / 1024 / 1024:.1f} MiB, {size / count:.0f} bytes per response")
+
+
+if __name__ == "__main__":
+    main()
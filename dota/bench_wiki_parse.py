@@ -0,0 +1,73 @@
+""" Benchmarks the Responses page extractors in dota_wiki.py against saved pages.
+
+Uses the pages in the scraper's HTTP cache by default, so run dota_wiki.py once first:
+    python bench_wiki_parse.py
+    python bench_wiki_parse.py --pages saved_wiki/ --repeat 5
+
+Fails if the extractors disagree on any page.
+"""
+import argparse
+import json
+import pathlib
+import sys
+import time
+
+import dota_wiki
+
+
+def load_pages(directory) -> dict:
+    """ Returns {name: html} for the Responses pages in a directory.
+        Reads the scraper's cache (which stores each page's URL next to it) or plain HTML files.
+    """
+    pages = {}
+    for path in sorted(pathlib.Path(directory).iterdir()):
+        if path.suffix == '.json':
+            with open(path, 'r') as f:
+                url = json.load(f)['url']
+            if url.endswith('/Responses'):
+                pages[url] = path.with_suffix('.html').read_text(encoding='utf-8')
+        elif path.suffix in ('.html', '.htm') and not path.with_suffix('.json').exists():
+            pages[path.name] = path.read_text(encoding='utf-8')
+    return pages
+
+
+def bench(extractor, pages, repeat) -> tuple:
+    """ Returns (best seconds over all pages, results by page). """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = {name: extractor(html) for name, html in pages.items()}
+        best = min(best, time.perf_counter() - start)
+    return best, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the wiki Responses page extractors.")
+    parser.add_argument('--pages', default=dota_wiki.CACHE_DIRECTORY, help="directory of saved pages")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per extractor (best is reported)")
+    args = parser.parse_args()
+
+    pages = load_pages(args.pages)
+    if not pages:
+        print(f"No Responses pages found in {args.pages}")
+        sys.exit(1)
+    size = sum(len(html) for html in pages.values())
+    print(f"{len(pages)} pages, {size / 1e6:.1f} MB")
+
+    old_time, old_results = bench(dota_wiki.parse_responses_soup, pages, args.repeat)
+    new_time, new_results = bench(dota_wiki.parse_responses, pages, args.repeat)
+    print(f"BeautifulSoup (html.parser): {old_time:.3f}s")
+    print(f"{'lxml' if dota_wiki.lxml_html else 'BeautifulSoup + SoupStrainer'}: {new_time:.3f}s "
+          f"({old_time / new_time:.1f}x faster)")
+
+    # Both extractors must produce the same responses.
+    mismatches = [name for name in pages if old_results[name] != new_results[name]]
+    for name in mismatches:
+        print(f"MISMATCH: {name}")
+    if mismatches:
+        sys.exit(1)
+    print(f"Identical output ({sum(len(r) for r in new_results.values())} responses)")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,64 +1,216 @@
+import asyncio
+import bisect
+import concurrent.futures
+import logging
 import sqlite3
 
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord.commands import slash_command
 
 
+class Leaderboard:
+    """ Users ranked by gold, kept sorted as gold changes.
+        Top users and a single user's rank are found without scanning everyone.
+    """
+    def __init__(self) -> None:
+        # Gold and display name by user id.
+        self.gold = {}
+        self.names = {}
+        # (-gold, user id) pairs in ascending order, i.e. richest first.
+        self.ranking = []
+
+    def set(self, user_id, name, gold):
+        """ Sets a user's gold. """
+        old_gold = self.gold.get(user_id)
+        if old_gold is not None:
+            del self.ranking[bisect.bisect_left(self.ranking, (-old_gold, user_id))]
+        self.gold[user_id] = gold
+        self.names[user_id] = name
+        bisect.insort(self.ranking, (-gold, user_id))
+
+    def add(self, user_id, name, gold):
+        """ Adds gold to a user. """
+        self.set(user_id, name, self.gold.get(user_id, 0) + gold)
+
+    def top(self, count) -> list:
+        """ Returns (name, gold) for the richest users. """
+        return [(self.names[user_id], -gold) for gold, user_id in self.ranking[:count]]
+
+    def rank(self, user_id):
+        """ Returns the 1-based rank of a user (ties share a rank), or None if they have no gold. """
+        gold = self.gold.get(user_id)
+        if gold is None:
+            return None
+        # (-gold,) sorts before every (-gold, user_id), so this counts the users with more gold.
+        return bisect.bisect_left(self.ranking, (-gold,)) + 1
+
+    def __len__(self):
+        return len(self.ranking)
+
+
 class DotaDatabase(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.database = sqlite3.connect("database.sqlite")
+        # Every query after startup runs on this one thread, so the event loop
+        # never waits on disk and the connection is never used concurrently.
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="database")
+        self.database = sqlite3.connect("database.sqlite", check_same_thread=False)
         self.cursor = self.database.cursor()
+        # Write-ahead logging lets commits skip most fsyncs and readers run alongside the writer.
+        self.cursor.execute("PRAGMA journal_mode = WAL")
+        self.cursor.execute("PRAGMA synchronous = NORMAL")
         user_fields = ("id INT",
                        "name TEXT",
                        "gold INT",
                        )
         self.cursor.execute(
             f"CREATE TABLE IF NOT EXISTS users ({','.join(user_fields)})")
-        self.emojis = self.bot.get_cog('Emojis')
+        self.create_user_index()
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS users_gold ON users (gold)")
+        # Which guilds each user has earned gold in, for the per-guild leaderboards.
+        self.cursor.execute(
+            "CREATE TABLE IF NOT EXISTS guild_users (guild_id INT, user_id INT, PRIMARY KEY (guild_id, user_id))")
+        self.database.commit()
+
+        # Gold waiting to be written, keyed by user id: [display name, gold].
+        self.pending_gold = {}
+        # Guild memberships waiting to be written, as (guild id, user id).
+        self.pending_guild_users = set()
+
+        # In-memory leaderboards, updated as gold is added.
+        self.leaderboard = Leaderboard()
+        self.guild_leaderboards = {}  # key = guild id, value = Leaderboard
+        self.user_guilds = {}  # key = user id, value = set of guild ids
+        self.load_leaderboards()
+        self.flush_gold.start()
+
         # Expose self to other cogs.
         self.bot.database = self
 
-    def add_user(self, user):
-        """ Adds a new user to the database """
-        query = "SELECT * from users WHERE id = ?"
-        values = (user.id,)
-        self.cursor.execute(query, values)
-        result = self.cursor.fetchone()
-        if not result:
-            query = "INSERT or IGNORE INTO users (id, name, gold) VALUES (?,?,?)"
-            values = (user.id, user.display_name, 0)
-            print(query, values)
-            self.cursor.execute(query, values)
-            self.database.commit()
-
-    def user_add_gold(self, user, gold):
-        """ Adds gold to a user's account """
-        self.add_user(user)
-        query = f"UPDATE users SET gold = gold + ? WHERE id = ?"
-        values = (gold, user.id)
-        print(query, values)
-        self.cursor.execute(query, values)
-        self.database.commit()
+    def create_user_index(self):
+        """ Makes user ids unique so gold can be upserted, merging any duplicate rows first. """
+        exists = self.cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'users_id'").fetchone()
+        if exists:
+            return
+        with self.database:
+            self.cursor.execute(
+                "UPDATE users SET gold = (SELECT SUM(gold) FROM users AS u WHERE u.id = users.id) "
+                "WHERE id IN (SELECT id FROM users GROUP BY id HAVING COUNT(*) > 1)")
+            self.cursor.execute(
+                "DELETE FROM users WHERE rowid NOT IN (SELECT MIN(rowid) FROM users GROUP BY id)")
+            self.cursor.execute("CREATE UNIQUE INDEX users_id ON users (id)")
 
-    def user_get_gold(self, user):
-        """ Returns the balance of a user """
-        query = f"SELECT gold FROM users WHERE id = ?"
-        values = (user.id,)
-        self.cursor.execute(query, values)
-        gold = self.cursor.fetchone()
-        return 0 if gold is None else gold[0]
+    @property
+    def emojis(self):
+        """ The Emojis cog (it's loaded after this one). """
+        return self.bot.get_cog('Emojis')
+
+    def load_leaderboards(self):
+        """ Loads everyone's gold into the leaderboards. """
+        for user_id, name, gold in self.cursor.execute("SELECT id, name, gold FROM users ORDER BY gold DESC"):
+            # Rows arrive richest first, so they can be appended in order.
+            self.leaderboard.gold[user_id] = gold
+            self.leaderboard.names[user_id] = name
+            self.leaderboard.ranking.append((-gold, user_id))
+        # Break ties by user id, like Leaderboard.set() does.
+        self.leaderboard.ranking.sort()
+
+        for guild_id, user_id in self.cursor.execute("SELECT guild_id, user_id FROM guild_users").fetchall():
+            if user_id in self.leaderboard.gold:
+                self.add_guild_user(guild_id, user_id)
+        print(f"Loaded {len(self.leaderboard)} users into the leaderboard")
+
+    def add_guild_user(self, guild_id, user_id):
+        """ Adds a user to a guild's leaderboard. """
+        guilds = self.user_guilds.setdefault(user_id, set())
+        if guild_id in guilds:
+            return False
+        guilds.add(guild_id)
+        leaderboard = self.guild_leaderboards.setdefault(guild_id, Leaderboard())
+        leaderboard.set(user_id, self.leaderboard.names[user_id], self.leaderboard.gold[user_id])
+        return True
+
+    async def run(self, function, *args):
+        """ Runs a blocking database function on the database thread. """
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    def cog_unload(self):
+        """ Writes any pending gold before the cog goes away. """
+        self.flush_gold.cancel()
+        pending, self.pending_gold = self.pending_gold, {}
+        guild_users, self.pending_guild_users = self.pending_guild_users, set()
+        self.executor.submit(self.write_gold, pending, guild_users).result()
+        self.executor.shutdown()
+
+    def user_add_gold(self, user, gold, guild=None):
+        """ Adds gold to a user's account, optionally earned in a guild.
+            The leaderboards update right away; the gold is written in the next
+            flush, together with everyone else's.
+        """
+        entry = self.pending_gold.get(user.id)
+        if entry is None:
+            self.pending_gold[user.id] = [user.display_name, gold]
+        else:
+            entry[0] = user.display_name
+            entry[1] += gold
+
+        # Update the leaderboards.
+        self.leaderboard.add(user.id, user.display_name, gold)
+        for guild_id in self.user_guilds.get(user.id, ()):
+            self.guild_leaderboards[guild_id].set(user.id, user.display_name, self.leaderboard.gold[user.id])
+        if guild is not None and self.add_guild_user(guild.id, user.id):
+            self.pending_guild_users.add((guild.id, user.id))
+
+    async def flush(self):
+        """ Writes all pending gold in a single transaction. """
+        if not self.pending_gold and not self.pending_guild_users:
+            return
+        pending, self.pending_gold = self.pending_gold, {}
+        guild_users, self.pending_guild_users = self.pending_guild_users, set()
+        try:
+            await self.run(self.write_gold, pending, guild_users)
+        except sqlite3.Error as error:
+            # Put everything back so the next flush can retry it.
+            logging.error(f"Failed to write gold for {len(pending)} users: {error}")
+            for user_id, (name, gold) in pending.items():
+                entry = self.pending_gold.setdefault(user_id, [name, 0])
+                entry[1] += gold
+            self.pending_guild_users |= guild_users
+
+    def write_gold(self, pending, guild_users):
+        """ Upserts the gold deltas and guild memberships. Runs on the database thread. """
+        query = ("INSERT INTO users (id, name, gold) VALUES (?,?,?) "
+                 "ON CONFLICT (id) DO UPDATE SET name = excluded.name, gold = gold + excluded.gold")
+        values = [(user_id, name, gold) for user_id, (name, gold) in pending.items()]
+        with self.database:
+            self.database.executemany(query, values)
+            self.database.executemany(
+                "INSERT OR IGNORE INTO guild_users (guild_id, user_id) VALUES (?,?)", guild_users)
+        logging.debug(f"Wrote gold for {len(values)} users")
+
+    @tasks.loop(seconds=30)
+    async def flush_gold(self):
+        """ Periodically writes pending gold. """
+        await self.flush()
+
+    async def user_get_gold(self, user):
+        """ Returns the balance of a user, including gold that hasn't been written yet. """
+        return self.leaderboard.gold.get(user.id, 0)
 
     @slash_command(name="top", description="List users with the most gold.")
-    async def top(self, ctx):
+    async def top(self, ctx, server: discord.commands.Option(bool, "Only users in this server", required=False)):
         """ Sends a list of the users with the most gold """
-        query = f"SELECT * FROM users ORDER BY gold DESC LIMIT 10"
-        self.cursor.execute(query)
-        users = self.cursor.fetchall()
-        gold_icon = self.emojis.emojis.get('Gold', '*gold*')
+        leaderboard = self.leaderboard
+        title = "Top Users"
+        if server and ctx.guild is not None:
+            leaderboard = self.guild_leaderboards.get(ctx.guild.id, Leaderboard())
+            title = f"Top Users in {ctx.guild.name}"
+        users = leaderboard.top(10)
+        gold_icon = self.emojis.get('Gold', '*gold*')
         text = ""
-        for i, user in enumerate(users):
+        for i, (name, gold) in enumerate(users):
             if i == 0:
               emoji = ":crown:"
             elif i == 1:
@@ -67,8 +219,8 @@ class DotaDatabase(commands.Cog):
               emoji = ":third_place:"
             else:
               emoji = ""
-            text += f"{i+1}. **{user[1]}**: {user[2]} {gold_icon} {emoji}" + "\n"
-        embed = discord.Embed(title="Top Users")
+            text += f"{i+1}. **{name}**: {gold} {gold_icon} {emoji}" + "\n"
+        embed = discord.Embed(title=title)
         embed.set_thumbnail(
             url="https://api.opendota.com/apps/dota2/images/abilities/alchemist_goblins_greed_md.png")
         embed.description = text
@@ -77,10 +229,25 @@ class DotaDatabase(commands.Cog):
     @slash_command(name="gold", description="Check your current gold balance.")
     async def gold(self, ctx):
         """ Sends the user's current gold balance """
-        gold = self.user_get_gold(ctx.author)
-        gold_icon = self.emojis.emojis.get('Gold', '*gold*')
+        gold = await self.user_get_gold(ctx.author)
+        gold_icon = self.emojis.get('Gold', '*gold*')
         await ctx.respond(f"{ctx.author.mention}, you have **{gold}** {gold_icon}")
 
+    @slash_command(name="rank", description="Check your place on the leaderboard.")
+    async def rank(self, ctx):
+        """ Sends the user's global and server rank """
+        rank = self.leaderboard.rank(ctx.author.id)
+        if rank is None:
+            await ctx.respond(f"{ctx.author.mention}, you're not on the leaderboard yet. Play /quiz to earn gold!")
+            return
+        text = f"{ctx.author.mention}, you are **#{rank:,}** of {len(self.leaderboard):,}"
+        if ctx.guild is not None and ctx.guild.id in self.guild_leaderboards:
+            guild_leaderboard = self.guild_leaderboards[ctx.guild.id]
+            guild_rank = guild_leaderboard.rank(ctx.author.id)
+            if guild_rank is not None:
+                text += f" (**#{guild_rank:,}** of {len(guild_leaderboard):,} in this server)"
+        await ctx.respond(text)
+
 
 def setup(bot):
     print("Loading DotaDatabase cog")
@@ -1,6 +1,8 @@
 """ Emojis """
 from discord.ext import commands
 
+from dota.cogs.wiki import normalize_name
+
 # DotA Heroes servers
 SERVERS = [650182236490170369, 650182259248463907, 650180306782912533]
 
@@ -22,18 +24,24 @@ class Emojis(commands.Cog):
         self.bot = bot
         # Call bot.get_cog('Emojis').load_emojis() in the on_ready function to populate this
         self.emojis = {}
+        # Used to look up heroes by their other names.
+        self.dota_wiki = self.bot.get_cog('DotaWikiCog')
 
-    def get(self, emoji_name):
-        """ Get an emoji. """
-        emoji_name = emoji_name.replace(' ', '')
-        return self.emojis.get(emoji_name, "")
+    def get(self, emoji_name, default=""):
+        """ Get an emoji by name, ignoring case and punctuation. Hero aliases work too. """
+        emoji = self.emojis.get(normalize_name(emoji_name))
+        if emoji is None and self.dota_wiki is not None:
+            hero = self.dota_wiki.get_hero(emoji_name, fuzzy=False)
+            if hero is not None:
+                emoji = self.emojis.get(normalize_name(hero.name))
+        return emoji or default
 
     def load_emojis(self):
         """ Loads all emojis from the 3 servers above """
         for guild_id in SERVERS:
             guild = self.bot.get_guild(guild_id)
             for emoji in guild.emojis:
-                self.emojis[emoji.name] = str(emoji)
+                self.emojis[normalize_name(emoji.name)] = str(emoji)
         print(f"Loaded {len(self.emojis.keys())} emojis.")
 
     # @commands.check(author_is_plomdawg)
@@ -6,6 +6,7 @@ command_list = """
 "/quiz" - *Play the Shopkeeper's quiz*
 "/gold" - *Check your gold balance*
 "/top" - *List the top gold balances*
+"/rank" - *Check your place on the leaderboard*
 "[exact quote]" - *Play a voiceline*
 "dota [partial quote]" - *Play a voiceline*
 "dota [partial quote] [n]" - *Play voiceline n out of many*
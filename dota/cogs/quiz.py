@@ -19,18 +19,41 @@ def strip_punctuation(text):
     return text.replace("'", "").replace("-", " ")
 
 
+# Scrambles made for each word when it's loaded. Rounds pick one of these.
+SCRAMBLES_PER_WORD = 8
+
+# Shuffles to try before falling back to rotating the word.
+MAX_SHUFFLES = 20
+
+
 def scramble(word) -> str:
-    """ Randomly scrambles a word """
+    """ Randomly scrambles a word. Words with only one distinct character (e.g. "A") can't be scrambled and are returned as is. """
+    if len(set(word)) < 2:
+        return word
+
+    # Shuffle until the word changes. Short words like "Io" often shuffle back into themselves.
     char_list = list(word)
-    random.shuffle(char_list)
-    scrambled = ''.join(char_list)
-    # Try again if the word isn't scrambled.
-    if word in scrambled:
-        return scramble(word)
-    return scrambled
+    for _ in range(MAX_SHUFFLES):
+        random.shuffle(char_list)
+        scrambled = ''.join(char_list)
+        if scrambled != word:
+            return scrambled
+
+    # Unlucky, rotate it instead. Some rotation always differs since there are two distinct characters.
+    for shift in range(1, len(word)):
+        rotated = word[shift:] + word[:shift]
+        if rotated != word:
+            return rotated
+
+
+def easy_scramble(text) -> str:
+    """ Scrambles each word in the text separately, keeping the spaces in place. """
+    return " ".join(scramble(word) for word in text.split(" "))
 
 
 class Word:
+    __slots__ = ("text", "category", "image", "url", "emoji", "hint", "answer", "scrambles", "easy_scrambles")
+
     def __init__(self, text, category, image, url, emoji=None, hint=None) -> None:
         self.text = text
         self.category = category
@@ -38,24 +61,69 @@ class Word:
         self.url = url
         self.emoji = emoji
         self.hint = hint
+        # What guesses are compared against.
+        self.answer = strip_punctuation(text.lower())
+
+        # Scramble ahead of time so rounds only have to pick one.
+        letters = strip_punctuation(text).upper()
+        self.scrambles = tuple({scramble(letters) for _ in range(SCRAMBLES_PER_WORD)})
+        self.easy_scrambles = tuple({easy_scramble(letters) for _ in range(SCRAMBLES_PER_WORD)})
 
     @property
     def scrambled(self) -> str:
         """ Returns the scrambled text """
-        return scramble(strip_punctuation(self.text).upper())
+        return random.choice(self.scrambles)
 
     @property
     def easy_scrambled(self) -> str:
         """ Returns the scrambled text, with spaces in place """
-        scrambled = ""
-        for word in strip_punctuation(self.text).split(" "):
-            scrambled += scramble(word) + " "
-        # Remove trailing space and capitalize.
-        return scrambled[:-1].upper()
+        return random.choice(self.easy_scrambles)
 
     def check(self, word) -> bool:
         """ Returns True if text matches the word, ignoring case and punctuation. """
-        return strip_punctuation(word.lower()) == strip_punctuation(self.text.lower())
+        return strip_punctuation(word.lower()) == self.answer
+
+
+class WordPool:
+    """ The quiz words, shared by every quiz and never changed once built. """
+
+    def __init__(self, words, checksum=None) -> None:
+        self.words = tuple(words)
+        # The wiki data the words were built from.
+        self.checksum = checksum
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def shuffled(self):
+        """ Returns a new random order to draw the words in. """
+        return WordDraw(self)
+
+
+class WordDraw:
+    """ Draws words from a pool in random order without repeats.
+
+    This is a Fisher-Yates shuffle done one step per draw. Only the positions
+    that have been swapped are stored, so starting a quiz doesn't copy the pool
+    and each draw is O(1).
+    """
+
+    def __init__(self, pool) -> None:
+        self.pool = pool
+        self.remaining = len(pool)
+        self.swapped = {}
+
+    def draw(self) -> Word:
+        """ Returns the next word. Starts over once every word has been drawn. """
+        if self.remaining == 0:
+            self.remaining = len(self.pool)
+            self.swapped = {}
+        index = random.randrange(self.remaining)
+        self.remaining -= 1
+        # Move the last undrawn position into the drawn one's place.
+        drawn = self.swapped.get(index, index)
+        self.swapped[index] = self.swapped.pop(self.remaining, self.remaining)
+        return self.pool.words[drawn]
 
 
 class Quiz:
@@ -67,17 +135,29 @@ class Quiz:
         self.current_word = None
         self.channel = channel  # discord text channel.
         self.guesses = {}  # current guesses for a round.
+        self.answers = asyncio.Queue()  # correct answers for the current round.
 
-        # Create a copy of the word list so we can pop() from it.
-        self.words = words.copy()
+        # Our own random order through the shared word pool.
+        self.words = words.shuffled()
 
     def next_word(self):
-        """ Gets the next word from the word list. """
-        index = random.randrange(len(self.words))
-        word = self.words.pop(index)
+        """ Gets the next word from the word pool. """
+        word = self.words.draw()
         self.current_word = word
         return word
 
+    def guess(self, message):
+        """ Called by the dispatcher for each message in the quiz channel. """
+        # Keep track of guesses per user.
+        try:
+            self.guesses[message.author].append(message.content)
+        except KeyError:
+            self.guesses[message.author] = [message.content]
+
+        # Hand correct answers to the round.
+        if self.current_word is not None and self.current_word.check(message.content):
+            self.answers.put_nowait(message)
+
     def add_score(self, elapsed_time, user):
         """ Calculates and adds to a user's score. """
         # More points for fast guesses.
@@ -93,7 +173,7 @@ class Quiz:
             self.correct_answers[user] = 1
         return score
 
-    async def start_phase(self, message, check, category=False, easy=False, hint=False):
+    async def start_phase(self, message, category=False, easy=False, hint=False):
         """ Start a phase by editing the message given. Returns the answer if solved. """
         # Manually create an embedded message.
         embed = discord.Embed()
@@ -123,11 +203,11 @@ class Quiz:
 
         # Edit the message for this round.
         embed.description = description
-        await message.edit(embed=embed)
+        await plomcord.scheduler.edit(message, embed=embed)
 
         # Wait for the answer.
         try:
-            answer = await self.bot.wait_for('message', check=check, timeout=self.round_time)
+            answer = await asyncio.wait_for(self.answers.get(), timeout=self.round_time)
         except asyncio.TimeoutError:
             answer = None
 
@@ -146,37 +226,24 @@ class Quiz:
         # Grab the next word.
         self.next_word()
 
-        # Keep track of guesses.
+        # Keep track of guesses, and drop answers to the last word.
         self.guesses = {}
-
-        # This is called for each response, returns True if the guess is correct
-        def check(msg):
-            # Make sure the message is from this server.
-            if msg.channel.guild != self.channel.guild:
-                return False
-
-            # Keep track of guesses per user.
-            try:
-                self.guesses[msg.author].append(msg.content)
-            except KeyError:
-                self.guesses[msg.author] = [msg.content]
-
-            return self.current_word.check(msg.content)
+        self.answers = asyncio.Queue()
 
         # Begin phase 1: hard scramble.
-        answer, embed = await self.start_phase(message, check)
+        answer, embed = await self.start_phase(message)
 
         # Begin phase 2: hard scramble with a category.
         if answer is None:
-            answer, embed = await self.start_phase(message, check, category=True)
+            answer, embed = await self.start_phase(message, category=True)
 
         # Begin phase 3: easy scramble with the category.
         if answer is None:
-            answer, embed = await self.start_phase(message, check, category=True, easy=True)
+            answer, embed = await self.start_phase(message, category=True, easy=True)
 
         # Begin phase 4 if we have a hint: easy scramble with a hint.
         if answer is None and self.current_word.hint is not None:
-            answer, embed = await self.start_phase(message, check, category=True, easy=True, hint=True)
+            answer, embed = await self.start_phase(message, category=True, easy=True, hint=True)
 
         #
         # Round is now over.
@@ -192,7 +259,7 @@ class Quiz:
         # Somebody answered!
         if answer:
             # Add a thumbs up to the correct answer.
-            await answer.add_reaction("👍")
+            await plomcord.scheduler.add_reaction(answer, "👍")
 
             # Increment user's score.
             elapsed_time = time.perf_counter() - start_time
@@ -206,7 +273,7 @@ class Quiz:
         # Game over if nobody answered.
         if answer is None:
             # Send a thumbs down on the quiz message.
-            await message.add_reaction("👎")
+            await plomcord.scheduler.add_reaction(message, "👎")
 
             # Set the footer.
             embed.set_footer(
@@ -216,7 +283,7 @@ class Quiz:
             self.in_progress = False
 
         # Edit the message.
-        await message.edit(embed=embed)
+        await plomcord.scheduler.edit(message, embed=embed)
 
     async def start(self):
         """ Start the quiz. """
@@ -260,7 +327,10 @@ class Quiz:
                 else:
                     losers.append(user)
                 # Increment user's gold amounts in the database.
-                self.bot.database.user_add_gold(user, score)
+                self.bot.database.user_add_gold(user, score, guild=self.channel.guild)
+
+            # Write everyone's gold in one go.
+            await self.bot.database.flush()
 
             # If there are no winners, everybody lost!
             if len(winners) == 0:
@@ -298,19 +368,38 @@ class Quiz:
             thumbnail=thumbnail,
             footer=f"To play again, press NEW or type /quiz"
         )
-        await message.add_reaction("🆕")
+        await plomcord.add_reactions(message, ["🆕"])
 
 
 class ShopkeeperQuiz(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.quizzes = {}  # key = guild, value = quiz
+        self.channels = {}  # key = channel id, value = quiz running there
+        self.words = None  # WordPool, built by load_words()
 
         # Load other cogs.
         self.database = self.bot.get_cog('Database')
         self.dota_wiki = self.bot.get_cog('DotaWikiCog')
         self.emojis = self.bot.get_cog('Emojis')
 
+    @ commands.Cog.listener()
+    async def on_message(self, message):
+        """ Hands messages in a quiz channel to that quiz. """
+        quiz = self.channels.get(message.channel.id)
+        if quiz is None or message.author.bot:
+            return
+        quiz.guess(message)
+
+    async def run_quiz(self, quiz):
+        """ Runs a quiz, sending it the messages from its channel while it's running. """
+        self.channels[quiz.channel.id] = quiz
+        try:
+            await quiz.start()
+        finally:
+            if self.channels.get(quiz.channel.id) is quiz:
+                del self.channels[quiz.channel.id]
+
     @ commands.Cog.listener()
     async def on_reaction_add(self, reaction, user):
         # Ignore own reactions
@@ -343,15 +432,30 @@ class ShopkeeperQuiz(commands.Cog):
         except discord.errors.NotFound:
             pass
 
-    def load_words(self) -> list:
-        self.words = []
+    def load_words(self) -> None:
+        # Keep the words from the last on_ready if the wiki data hasn't changed.
+        if self.words is not None and self.words.checksum == self.dota_wiki.checksum:
+            return
+        self.words = self.build_words(self.dota_wiki.data)
+        print(f"Loaded {len(self.words)} quiz words.")
+
+    def prepare_wiki_reload(self, data):
+        """ Builds the word pool from new wiki data. Runs in a thread. """
+        return self.build_words(data)
+
+    def finish_wiki_reload(self, words):
+        """ Swaps in the word pool from prepare_wiki_reload. Quizzes in progress keep using the old one. """
+        self.words = words
+
+    def build_words(self, data) -> WordPool:
+        words = []
 
         # Add the heroes and abilities.
-        for hero in self.dota_wiki.heroes:
+        for hero in data.heroes:
             emoji = self.emojis.get(hero.name)
 
             # Heroes do not have a hint.
-            self.words.append(
+            words.append(
                 Word(
                     text=hero.name,
                     category="Heroes",
@@ -362,7 +466,7 @@ class ShopkeeperQuiz(commands.Cog):
             )
             for ability in hero.abilities:
                 # Use the lore as the hint.
-                self.words.append(
+                words.append(
                     Word(
                         text=ability.name,
                         category="Abilities",
@@ -374,9 +478,9 @@ class ShopkeeperQuiz(commands.Cog):
                 )
 
         # Add the items.
-        for item in self.dota_wiki.items:
+        for item in data.items:
             # Use the lore as the hint.
-            self.words.append(
+            words.append(
                 Word(
                     text=item.name,
                     category="Items",
@@ -386,7 +490,7 @@ class ShopkeeperQuiz(commands.Cog):
                 )
             )
 
-        print(f"Loaded {len(self.words)} quiz words.")
+        return WordPool(words, checksum=data.checksum)
 
     async def shopkeeper_quiz(self, bot, channel):
         # Try to find existing quiz.
@@ -402,7 +506,7 @@ class ShopkeeperQuiz(commands.Cog):
             bot=bot, words=self.words, channel=channel)
 
         # Begin the quiz.
-        asyncio.ensure_future(self.quizzes[channel.guild].start())
+        asyncio.ensure_future(self.run_quiz(self.quizzes[channel.guild]))
 
     @ slash_command(name="quiz", description="Play the Shopkeeper's quiz")
     async def quiz(self, ctx):
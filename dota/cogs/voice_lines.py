@@ -1,21 +1,194 @@
 import asyncio
+import logging
+import os
 import sqlite3
 import random
+import re
+import time
 import plomcord
+import discord
+from discord.commands import slash_command
 from discord.ext import commands
 
+from dota.cogs.emojis import author_is_plomdawg
+
+# Prewarm the audio cache in the background on startup.
+# Set to "all" for every voice line, or a number for the N most played lines.
+DOTA_PREWARM = os.environ.get('DOTA_PREWARM')
+
+
+# Where the responses are stored.
+DATABASE_PATH = "dota-responses.sqlite"
+
+# Version of the responses database schema. Bump it when the schema changes
+# and the database will be rebuilt from the wiki data on the next startup.
+SCHEMA_VERSION = 1
+
+# Columns of the responses table, in the order respond() unpacks them.
+RESPONSE_COLUMNS = "responses.name, responses.responses_url, responses.url, responses.text, responses.thumbnail"
+
+
+def fts_query(text):
+    """ Converts user text into an FTS5 query matching every word as a prefix.
+        Example: 'ha "ha' -> '"ha"* "ha"*'
+    """
+    return ' '.join(f'"{token}"*' for token in re.findall(r"\w+", text))
+
+
+def like_pattern(text):
+    """ Escapes LIKE wildcards in the text and wraps it in %'s. """
+    text = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"%{text}%"
+
+
+def normalize_text(text):
+    """ Normalizes response text for exact matching.
+        Example: " Ha ha… " -> "Ha ha..."
+    """
+    return text.replace('…', '...').strip()
+
+
+def create_schema(connection) -> bool:
+    """ Creates the responses tables, rebuilding them if the schema is out of date.
+        Returns True if full-text search is available.
+    """
+    version = connection.execute("PRAGMA user_version").fetchone()[0]
+    if version != SCHEMA_VERSION:
+        # Everything in here comes from the wiki data, so it's safe to start over.
+        print(f"Rebuilding responses database (schema version {version} -> {SCHEMA_VERSION})")
+        connection.executescript("""
+            DROP TABLE IF EXISTS responses_fts;
+            DROP TABLE IF EXISTS responses;
+            DROP TABLE IF EXISTS metadata;
+        """)
+
+    connection.executescript("""
+        CREATE TABLE IF NOT EXISTS responses (
+            name TEXT NOT NULL,
+            responses_url TEXT,
+            url TEXT NOT NULL,
+            text TEXT NOT NULL,
+            thumbnail TEXT,
+            UNIQUE (name, url)
+        );
+        CREATE INDEX IF NOT EXISTS responses_name ON responses (name);
+        CREATE INDEX IF NOT EXISTS responses_text ON responses (text);
+        CREATE TABLE IF NOT EXISTS metadata (key TEXT PRIMARY KEY, value TEXT);
+    """)
+
+    # Full-text index over the response text, kept in sync by triggers.
+    # It's an external content table: the index points at rows in the responses table.
+    # prefix='2 3' keeps short prefix queries like "ha*" fast.
+    fts_existed = connection.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'responses_fts'").fetchone() is not None
+    try:
+        connection.executescript("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS responses_fts USING fts5(
+                text, content='responses', tokenize='unicode61 remove_diacritics 2', prefix='2 3');
+            CREATE TRIGGER IF NOT EXISTS responses_insert AFTER INSERT ON responses BEGIN
+                INSERT INTO responses_fts (rowid, text) VALUES (new.rowid, new.text);
+            END;
+            CREATE TRIGGER IF NOT EXISTS responses_delete AFTER DELETE ON responses BEGIN
+                INSERT INTO responses_fts (responses_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+            END;
+            CREATE TRIGGER IF NOT EXISTS responses_update AFTER UPDATE ON responses BEGIN
+                INSERT INTO responses_fts (responses_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+                INSERT INTO responses_fts (rowid, text) VALUES (new.rowid, new.text);
+            END;
+        """)
+        # Index any rows added while full-text search was unavailable.
+        if not fts_existed:
+            connection.execute("INSERT INTO responses_fts (responses_fts) VALUES ('rebuild')")
+        full_text_search = True
+    except sqlite3.OperationalError as error:
+        logging.warning(f"Full-text search unavailable, falling back to LIKE: {error}")
+        full_text_search = False
+
+    connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    connection.commit()
+    return full_text_search
+
+
+def import_responses(connection, heroes, checksum) -> bool:
+    """ Brings the responses table up to date with the wiki data.
+        Skipped if the wiki data hasn't changed since the last import, otherwise
+        only the responses that were added, changed or removed are written.
+        Returns True if anything was imported.
+    """
+    changes = diff_responses(connection, heroes, checksum)
+    if changes is None:
+        print("Responses database is up to date")
+        return False
+    write_responses(connection, changes, checksum)
+    return True
+
+
+def diff_responses(connection, heroes, checksum):
+    """ Returns the responses to remove and to add or change, or None if the wiki data was already imported. """
+    row = connection.execute("SELECT value FROM metadata WHERE key = 'wiki_checksum'").fetchone()
+    if row is not None and row[0] == checksum:
+        return None
+
+    # The responses we want, keyed by the unique key.
+    wanted = {}
+    for hero in heroes:
+        for response in hero.responses:
+            wanted[(hero.name, response.url)] = (hero.responses_url, response.text, hero.thumbnail)
+
+    # The responses we have.
+    existing = {}
+    for name, responses_url, url, text, thumbnail in connection.execute(
+            "SELECT name, responses_url, url, text, thumbnail FROM responses"):
+        existing[(name, url)] = (responses_url, text, thumbnail)
+
+    removed = [key for key in existing if key not in wanted]
+    changed = [key + value for key, value in wanted.items() if existing.get(key) != value]
+    return removed, changed
+
+
+def write_responses(connection, changes, checksum) -> None:
+    """ Applies the changes from diff_responses and records the checksum of the data they came from. """
+    removed, changed = changes
+
+    # Apply the diff in a single transaction.
+    with connection:
+        connection.executemany("DELETE FROM responses WHERE name = ? AND url = ?", removed)
+        connection.executemany(
+            "INSERT INTO responses (name, url, responses_url, text, thumbnail) VALUES (?,?,?,?,?) "
+            "ON CONFLICT (name, url) DO UPDATE SET "
+            "responses_url = excluded.responses_url, text = excluded.text, thumbnail = excluded.thumbnail",
+            changed)
+        connection.execute(
+            "INSERT OR REPLACE INTO metadata (key, value) VALUES ('wiki_checksum', ?)", (checksum,))
+
+    print(f"Imported responses: {len(changed)} added or changed, {len(removed)} removed")
+
+
+def build_exact_index(heroes) -> tuple:
+    """ Maps normalized response text to its (hero, response) pairs, so exact matches never touch the database.
+        Returns the index and the length of the shortest and longest response.
+    """
+    # Only references are kept. The rows (and response URLs) are built when a message matches.
+    index = {}
+    for hero in heroes:
+        for response in hero.responses:
+            index.setdefault(normalize_text(response.text), []).append((hero, response))
+    print(f"Indexed {len(index)} unique responses for exact matching")
+
+    # Shortest and longest response, so most chat messages are rejected without hashing them.
+    lengths = [len(text) for text in index] or [0]
+    return index, min(lengths), max(lengths)
+
 
 def get_index_from_query(text):
     """ Splits off the last token in the string if it's a number.
-        Example: "dota haha 2" -> ("dota haha", 2)
+        Example: "dota haha 2" -> ("dota haha", 1)
     """
-    try:
-        tokens = text.split(' ')
-        index = int(tokens[-1]) - 1
-        text = ' '.join(tokens[:-1])
-    except:
-        index = None
-    return text, index
+    # Checked without raising, since this runs for every message.
+    tokens = text.rsplit(' ', 1)
+    if len(tokens) == 2 and tokens[1].isdecimal():
+        return tokens[0], int(tokens[1]) - 1
+    return text, None
 
 
 class DotaVoiceLinesCog(commands.Cog):
@@ -33,9 +206,14 @@ class DotaVoiceLinesCog(commands.Cog):
         self.audio = self.bot.get_cog('AudioCog')
         self.emojis = self.bot.get_cog('Emojis')
 
-        self.db_connection = sqlite3.connect("dota-responses.sqlite")
+        self.db_connection = sqlite3.connect(DATABASE_PATH)
         self.db_cursor = self.db_connection.cursor()
         self.create_database()
+        self.exact_index, self.exact_min_length, self.exact_max_length = build_exact_index(self.dota_wiki.heroes)
+
+        # Optionally fill the audio cache once the bot is up.
+        if DOTA_PREWARM is not None:
+            self.bot.loop.create_task(self.prewarm_in_background())
 
         @self.bot.event
         async def on_message(message):
@@ -77,31 +255,98 @@ class DotaVoiceLinesCog(commands.Cog):
                     return await self.respond(message, responses, index)
 
             elif text.lower().startswith("hero"):
-                # Split off the prefix.
-                hero_name = text.split(' ', 1)[1].title()
-                # Get a random response from the given hero that contains the text.
+                # Split off the prefix and find the hero, allowing aliases and typos.
+                hero = self.dota_wiki.get_hero(text.split(' ', 1)[1])
+                if hero is None:
+                    return
+                # Get a random response from the given hero.
                 responses, index = self.get_voice_responses(
-                    name=hero_name, index=index)
+                    name=hero.name, index=index)
                 if responses:
                     return await self.respond(message, responses, index)
 
     def create_database(self):
-        """ Creates the database and loads the json file into it. """
-        # Generate the table if needed.
-        text_fields = ("name", "responses_url", "url", "text", "thumbnail")
-        query = f"CREATE TABLE IF NOT EXISTS responses ({' TEXT, '.join(text_fields)} TEXT)"
-        self.db_cursor.execute(query)
+        """ Creates the database and brings it up to date with the wiki data. """
+        self.full_text_search = create_schema(self.db_connection)
+        import_responses(self.db_connection, self.dota_wiki.heroes, self.dota_wiki.checksum)
+
+    def prepare_wiki_reload(self, data):
+        """ Works out the database changes for new wiki data and indexes it. Runs in a thread. """
+        # sqlite connections can't be shared between threads, so use another one.
+        connection = sqlite3.connect(DATABASE_PATH)
+        try:
+            changes = diff_responses(connection, data.heroes, data.checksum)
+        finally:
+            connection.close()
+        return changes, data.checksum, build_exact_index(data.heroes)
+
+    def finish_wiki_reload(self, prepared):
+        """ Writes the changes and swaps in the index from prepare_wiki_reload. """
+        changes, checksum, exact_index = prepared
+        # The database is only written here, so a reload that fails while preparing leaves search on the old data too.
+        if changes is not None:
+            write_responses(self.db_connection, changes, checksum)
+        self.exact_index, self.exact_min_length, self.exact_max_length = exact_index
+
+    def find_exact(self, text) -> list:
+        """ Returns the responses whose text matches exactly, or an empty list. """
+        text = normalize_text(text)
+        if not self.exact_min_length <= len(text) <= self.exact_max_length:
+            return []
+        return [(hero.name, hero.responses_url, response.url, response.text, hero.thumbnail)
+                for hero, response in self.exact_index.get(text, ())]
+
+    @property
+    def voice_line_urls(self) -> list:
+        """ Returns the URL of every voice line. """
+        return [response.url for hero in self.dota_wiki.heroes for response in hero.responses]
+
+    async def prewarm_in_background(self):
+        """ Prewarms the audio cache after the bot connects. """
+        await self.bot.wait_until_ready()
+        top = None if DOTA_PREWARM == "all" else int(DOTA_PREWARM)
+        counts = await self.audio.prewarm(self.voice_line_urls, top=top)
+        logging.info(f"Prewarmed voice lines: {counts}")
 
-        # Populate the responses table.
-        for hero in self.dota_wiki.heroes:
-            print(
-                f"Adding {len(hero.responses)} responses for hero {hero.name}")
+    @slash_command(name="prewarm", description="Download voice lines ahead of time.")
+    @commands.check(author_is_plomdawg)
+    async def prewarm(self, ctx,
+                      top: discord.commands.Option(int, "Only the N most played lines", required=False),
+                      normalize: discord.commands.Option(bool, "Also transcode to Opus", required=False)):
+        """ Fills the audio cache with voice lines, reporting progress as it goes. """
+        await ctx.respond("Prewarming voice lines...")
 
-            query = f"INSERT or IGNORE INTO responses ({','.join(text_fields)}) VALUES (?,?,?,?,?)"
-            data = ([hero.name, hero.responses_url, response.url,
-                    response.text, hero.thumbnail] for response in hero.responses)
+        # Edit the response at most every few seconds.
+        last_update = time.monotonic()
 
-            self.db_cursor.executemany(query, (data))
+        def progress(counts):
+            nonlocal last_update
+            if time.monotonic() - last_update < 5:
+                return
+            last_update = time.monotonic()
+            done = counts["skipped"] + counts["fetched"] + counts["failed"]
+            asyncio.ensure_future(ctx.edit(content=f"Prewarming voice lines... {done}/{counts['total']}"))
+
+        counts = await self.audio.prewarm(self.voice_line_urls, top=top, normalize=bool(normalize), progress=progress)
+        await ctx.edit(content=f"Prewarmed {counts['fetched']} voice lines "
+                               f"({counts['skipped']} already cached, {counts['failed']} failed).")
+
+    @slash_command(name="reload", description="Reload the Dota wiki data without restarting.")
+    @commands.check(author_is_plomdawg)
+    async def reload(self, ctx):
+        """ Reloads the wiki data, voice line index and quiz words. """
+        await ctx.defer()
+        try:
+            reloaded = await self.dota_wiki.reload()
+        except Exception:
+            logging.exception("Failed to reload the wiki data, keeping the old data")
+            await ctx.respond("Failed to reload the wiki data, the old data is still loaded.")
+            return
+        if reloaded:
+            await ctx.respond(f"Reloaded the wiki data ({len(self.dota_wiki.heroes)} heroes, "
+                              f"{len(self.dota_wiki.items)} items).")
+        else:
+            await ctx.respond("The wiki data hasn't changed.")
 
     async def respond(self, message, responses, index, forward=True):
         name, response, url, text, thumbnail = responses[index]
@@ -111,6 +356,10 @@ class DotaVoiceLinesCog(commands.Cog):
         footer = f"voice line {index+1} out of {len(responses)}"
         warning_message = None
 
+        # Queue the voice response first. If it's turned away (spam), don't respond at all.
+        if not self.audio.play_url(url, message.author.voice.channel, user=message.author):
+            return
+
         # If the message was sent in my-dudes server,
         # forward the command to the music channel and
         # let the user know the command is being forwarded.
@@ -122,9 +371,8 @@ class DotaVoiceLinesCog(commands.Cog):
                 warning_message = await plomcord.send_embed(channel=text_channel, text=warning)
                 text_channel = self.bot.get_channel(int(408481491597787136))
 
-        # Respond to the message and play the voice response.
+        # Respond to the message.
         await plomcord.send_embed(channel=text_channel, text=text, thumbnail=thumbnail, footer=footer)
-        await self.audio.play_url(url, message.author.voice.channel)
 
         # Delete our own message in 10 seconds.
         if warning_message is not None:
@@ -133,25 +381,11 @@ class DotaVoiceLinesCog(commands.Cog):
 
     def get_voice_responses(self, exact_text=None, text=None, index=None, name=None):
         """ Find responses for the given query. """
-
-        # Construct the database operation.
         if exact_text:
-            # Match the exact response text.
-            operation = f'SELECT * FROM responses WHERE text = "{exact_text}"'
-        elif text:
-            # Match any response containing the text.
-            operation = f'SELECT * FROM responses WHERE text LIKE "%{text}%"'
-            # Match the hero name if specified.
-            if name:
-                operation += f' AND name = "{name}"'
+            # Exact matches come from the in-memory index.
+            responses = self.find_exact(exact_text)
         else:
-            operation = f'SELECT * FROM responses WHERE name = "{name}"'
-
-        # Replace elipses with periods.
-        operation = operation.replace('…', '...')
-
-        # Fetch the results.
-        responses = self.db_cursor.execute(operation).fetchall()
+            responses = self.search_responses(text=text, name=name)
 
         # Use a random index if not specified.
         if index is None and responses:
@@ -159,6 +393,38 @@ class DotaVoiceLinesCog(commands.Cog):
 
         return responses, index
 
+    def search_responses(self, text=None, name=None) -> list:
+        """ Searches the database for responses containing the text and/or from the named hero. """
+        # Replace elipses with periods.
+        if text:
+            text = text.replace('…', '...')
+
+        # Construct the database operation.
+        if text and self.full_text_search and fts_query(text):
+            # Match responses containing every word (as a prefix), best matches first.
+            operation = (f"SELECT {RESPONSE_COLUMNS} FROM responses_fts "
+                         "JOIN responses ON responses.rowid = responses_fts.rowid "
+                         "WHERE responses_fts MATCH ?")
+            parameters = [fts_query(text)]
+            # Match the hero name if specified.
+            if name:
+                operation += " AND responses.name = ?"
+                parameters.append(name)
+            operation += " ORDER BY rank"
+        elif text:
+            # Match any response containing the text.
+            operation = f"SELECT {RESPONSE_COLUMNS} FROM responses WHERE text LIKE ? ESCAPE '\\'"
+            parameters = [like_pattern(text)]
+            # Match the hero name if specified.
+            if name:
+                operation += " AND name = ?"
+                parameters.append(name)
+        else:
+            operation = f"SELECT {RESPONSE_COLUMNS} FROM responses WHERE name = ?"
+            parameters = [name]
+
+        # Fetch the results.
+        return self.db_cursor.execute(operation, parameters).fetchall()
 
 def setup(bot):
     print("Loading Dota Voice Lines cog")
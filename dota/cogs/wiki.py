@@ -1,51 +1,304 @@
 from discord.ext import commands
+import asyncio
 import discord
+import functools
 import json
+import os
+import sys
+import time
+
+from dota import wiki_format
+
+WIKI_JSON = "dota/dota_wiki.json"
+WIKI_DATA = "dota/dota_wiki.bin"
+
+# Voice response URLs all start with the same few prefixes, so each prefix is
+# stored once here and responses only keep an index and the rest of the URL.
+URL_PREFIXES = []
+URL_PREFIX_INDEXES = {}
+
+
+def split_url(url) -> tuple:
+    """ Splits a URL into a prefix index and a suffix.
+        The prefix is the scheme, host and first two path segments.
+    """
+    parts = url.split("/", 5)
+    if len(parts) < 6:
+        prefix, suffix = "", url
+    else:
+        prefix, suffix = "/".join(parts[:5]) + "/", parts[5]
+    index = URL_PREFIX_INDEXES.get(prefix)
+    if index is None:
+        index = URL_PREFIX_INDEXES[prefix] = len(URL_PREFIXES)
+        URL_PREFIXES.append(prefix)
+    return index, suffix
+
+
+# Other names people use for heroes, by normalized name.
+HERO_ALIASES = {
+    "am": "Anti-Mage",
+    "bs": "Bloodseeker",
+    "centaur": "Centaur Warrunner",
+    "ck": "Chaos Knight",
+    "cm": "Crystal Maiden",
+    "dk": "Dragon Knight",
+    "es": "Earthshaker",
+    "furion": "Nature's Prophet",
+    "lc": "Legion Commander",
+    "magnataur": "Magnus",
+    "naix": "Lifestealer",
+    "necrolyte": "Necrophos",
+    "np": "Nature's Prophet",
+    "obsidiandestroyer": "Outworld Destroyer",
+    "od": "Outworld Destroyer",
+    "outworlddevourer": "Outworld Destroyer",
+    "pa": "Phantom Assassin",
+    "pl": "Phantom Lancer",
+    "qop": "Queen of Pain",
+    "sf": "Shadow Fiend",
+    "sk": "Sand King",
+    "skeletonking": "Wraith King",
+    "ta": "Templar Assassin",
+    "tb": "Terrorblade",
+    "treant": "Treant Protector",
+    "wd": "Witch Doctor",
+    "windrunner": "Windranger",
+    "wisp": "Io",
+    "wk": "Wraith King",
+    "wr": "Windranger",
+}
+
+
+def normalize_name(name) -> str:
+    """ Lowercases a name and drops everything but letters and digits, so "Nature's Prophet" matches "natures prophet". """
+    return "".join(character for character in name.lower() if character.isalnum())
+
+
+def trigrams(name) -> set:
+    """ Returns the set of three letter sequences in a normalized name, padded so short names still have some. """
+    padded = f"  {name} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NameIndex:
+    """ Looks things up by name: exactly, by alias, then by the closest spelling. """
+
+    def __init__(self, entries, aliases=None, cutoff=0.4) -> None:
+        # Normalized name -> entry.
+        self.entries = {}
+        for entry in entries:
+            self.entries.setdefault(normalize_name(entry.name), entry)
+
+        # Aliases for entries that exist.
+        for alias, name in (aliases or {}).items():
+            entry = self.entries.get(normalize_name(name))
+            if entry is not None:
+                self.entries.setdefault(alias, entry)
+
+        # Trigram -> normalized names that contain it, for fuzzy matching.
+        self.trigrams = {}
+        self.trigram_counts = {}
+        for key in self.entries:
+            key_trigrams = trigrams(key)
+            self.trigram_counts[key] = len(key_trigrams)
+            for trigram in key_trigrams:
+                self.trigrams.setdefault(trigram, []).append(key)
+
+        # How similar a name has to be to count as a fuzzy match.
+        self.cutoff = cutoff
+
+    def get(self, name, fuzzy=True):
+        """ Returns the entry for a name or alias, or the closest match if fuzzy. None if nothing matches. """
+        key = normalize_name(name)
+        entry = self.entries.get(key)
+        if entry is not None or not fuzzy or not key:
+            return entry
+
+        # Count the trigrams each name shares with the query.
+        query = trigrams(key)
+        shared = {}
+        for trigram in query:
+            for candidate in self.trigrams.get(trigram, ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+        if not shared:
+            return None
+
+        # Pick the most similar name (Jaccard similarity of the trigram sets).
+        def similarity(candidate):
+            count = shared[candidate]
+            return count / (len(query) + self.trigram_counts[candidate] - count)
+        best = max(shared, key=similarity)
+        if similarity(best) < self.cutoff:
+            return None
+        return self.entries[best]
+
 
 class Ability:
+    __slots__ = ("lore", "name", "thumbnail", "url")
+
     def __init__(self, data) -> None:
         self.lore = data["lore"]
-        self.name = data["name"]
+        self.name = sys.intern(data["name"])
         self.thumbnail = data["thumbnail"]
         self.url = data["url"]
 
 class Hero:
+    __slots__ = ("abilities", "name", "responses", "responses_url", "thumbnail", "url")
+
     def __init__(self, data) -> None:
+        self.name = sys.intern(data["_name"])
         self.abilities = [Ability(ability) for ability in data["abilities"]]
-        self.name = data["_name"]
         self.responses = [VoiceResponse(response) for response in data["responses"]]
         self.thumbnail = data["thumbnail"]
         self.url = data["url"]
+        # One string per hero, shared by every response that links to it.
         self.responses_url = f"{self.url}/Responses"
 
 class VoiceResponse:
+    __slots__ = ("text", "url_prefix", "url_suffix")
+
     def __init__(self, data) -> None:
         self.text = data["text"]
-        self.url = data["url"]
+        self.url_prefix, self.url_suffix = split_url(data["url"])
+
+    @property
+    def url(self) -> str:
+        return URL_PREFIXES[self.url_prefix] + self.url_suffix
 
 class Item:
+    __slots__ = ("name", "cost", "lore", "thumbnail", "url")
+
     def __init__(self, data) -> None:
-        self.name = data["_name"]
+        self.name = sys.intern(data["_name"])
         self.cost = data["gold_cost"]
         self.lore = data["lore"]
         self.thumbnail = data["thumbnail"]
         self.url = data["url"]
 
 
+class WikiData:
+    """ One version of the wiki data. Heroes, items and the lookup indexes are built the first time they're used. """
+
+    def __init__(self) -> None:
+        # Compile the json into the compact format if the scraper's output is newer.
+        if os.path.exists(WIKI_JSON) and (not os.path.exists(WIKI_DATA) or
+                                          os.path.getmtime(WIKI_JSON) > os.path.getmtime(WIKI_DATA)):
+            print(f"Compiling {WIKI_JSON} into {WIKI_DATA}")
+            with open(WIKI_JSON, "r") as f:
+                wiki_format.write(json.load(f), WIKI_DATA)
+
+        # Memory map the data.
+        self.wiki_file = wiki_format.WikiFile(WIKI_DATA)
+
+        # Fingerprint of the data, so other cogs can tell when it changed.
+        self.checksum = self.wiki_file.checksum
+
+    @functools.cached_property
+    def heroes(self):
+        heroes = [Hero(hero) for hero in self.wiki_file.heroes()]
+        self.release_wiki_file(built="items")
+        return heroes
+
+    @functools.cached_property
+    def items(self):
+        items = [Item(item) for item in self.wiki_file.items()]
+        self.release_wiki_file(built="heroes")
+        return items
+
+    def release_wiki_file(self, built):
+        """ Closes the memory map if the other list has already been built from it. """
+        if built in self.__dict__:
+            self.wiki_file.close()
+
+    @functools.cached_property
+    def hero_index(self):
+        return NameIndex(self.heroes, aliases=HERO_ALIASES)
+
+    @functools.cached_property
+    def item_index(self):
+        return NameIndex(self.items)
+
+    @functools.cached_property
+    def ability_index(self):
+        return NameIndex(ability for hero in self.heroes for ability in hero.abilities)
+
+    def build(self):
+        """ Builds everything now instead of on first use. """
+        self.heroes, self.items, self.hero_index, self.item_index, self.ability_index
+        return self
+
+
 class DotaWikiCog(commands.Cog):
     def __init__(self, bot):
         # Store the bot instance so we can access it inside the cog.
         self.bot = bot
 
-        # Load the json file.
-        with open("dota/dota_wiki.json", "r") as f:
-            self.data = json.load(f)
+        # The current wiki data. Replaced as a whole by reload().
+        self.data = WikiData()
+
+        # Only one reload at a time.
+        self.reload_lock = asyncio.Lock()
+
+    @property
+    def heroes(self):
+        return self.data.heroes
+
+    @property
+    def items(self):
+        return self.data.items
+
+    @property
+    def checksum(self):
+        return self.data.checksum
+
+    def get_hero(self, name, fuzzy=True):
+        """ Returns the Hero with the given name or alias (or the closest name if fuzzy), or None. """
+        return self.data.hero_index.get(name, fuzzy=fuzzy)
+
+    def get_item(self, name, fuzzy=True):
+        """ Returns the Item with the given name (or the closest name if fuzzy), or None. """
+        return self.data.item_index.get(name, fuzzy=fuzzy)
+
+    def get_ability(self, name, fuzzy=True):
+        """ Returns the Ability with the given name (or the closest name if fuzzy), or None. """
+        return self.data.ability_index.get(name, fuzzy=fuzzy)
+
+    async def reload(self) -> bool:
+        """ Loads the wiki data again without restarting the bot.
+
+        The new data, and anything other cogs build from it, is built in a
+        thread so the event loop keeps running. Cogs take part by defining
+        prepare_wiki_reload(data), which runs in the thread and returns what
+        they built, and finish_wiki_reload(prepared), which swaps it in.
+        Every swap happens at once on the event loop, so nothing ever sees a
+        mix of old and new data. prepare_wiki_reload mustn't change anything
+        shared (like a database), since a later cog's prepare step can still
+        fail and leave the old data in place. Returns False if nothing changed.
+        """
+        async with self.reload_lock:
+            loop = asyncio.get_running_loop()
+            started = time.perf_counter()
+
+            # Load the new data.
+            data = await loop.run_in_executor(None, lambda: WikiData().build())
+            if data.checksum == self.checksum:
+                print("Wiki data hasn't changed, not reloading")
+                return False
+
+            # Let the other cogs build their part.
+            prepared = []
+            for cog in self.bot.cogs.values():
+                if hasattr(cog, "prepare_wiki_reload"):
+                    prepared.append((cog, await loop.run_in_executor(None, cog.prepare_wiki_reload, data)))
+
+            # Swap everything in. No awaits from here on.
+            self.data = data
+            for cog, result in prepared:
+                cog.finish_wiki_reload(result)
 
-        self.heroes = [Hero(hero) for hero in self.data["heroes"]]
-        self.items = [Item(item) for item in self.data["items"]]
-        
-    def get_hero(self, name):
-        return next((Hero(hero) for hero in self.heroes if hero["_name"] == name), None)
+            print(f"Reloaded wiki data in {time.perf_counter() - started:.1f}s "
+                  f"({len(data.heroes)} heroes, {len(data.items)} items)")
+            return True
 
     @discord.commands.slash_command(name="example", description="Example command description")
     async def example(self, ctx, example: discord.commands.Option(int, "Example optional argument", required=False)):
@@ -1,12 +1,29 @@
-import requests
+import aiohttp
+import argparse
+import asyncio
+import concurrent.futures
+import hashlib
 import yaml
 import json
-from bs4 import BeautifulSoup
+import os
+import pathlib
+from bs4 import BeautifulSoup, SoupStrainer
 import time
 import sys
 
+import wiki_format
+
+# lxml is much faster at parsing the huge Responses pages, but optional.
+try:
+    import lxml.html as lxml_html
+except ImportError:
+    lxml_html = None
+
 DOTA_WIKI_URL = "https://dota2.fandom.com"
 
+# Where fetched pages are cached between runs.
+CACHE_DIRECTORY = pathlib.Path(".wiki_cache")
+
 # Fix yaml indenting (https://stackoverflow.com/a/39681672/12757998).
 
 
@@ -15,18 +32,158 @@ class Dumper(yaml.Dumper):
         return super(Dumper, self).increase_indent(flow, False)
 
 
-def _load_page(url) -> BeautifulSoup:
-    # Load the page into BeautifulSoup.
-    print(f"Loading: {url}")
-    page = requests.get(url)
-    return BeautifulSoup(page.text, 'html.parser')
-
-
-def get_abilities(hero) -> list:
+class WikiFetcher:
+    """ Fetches wiki pages concurrently over a pooled connection, politely.
+
+    Pages are kept in an on-disk HTTP cache. Cached pages are revalidated with
+    their ETag/Last-Modified, so reruns only download pages that changed.
+    Point base_url at a local server of saved pages to run offline.
+
+    The sha1 of every page body is kept in digests and saved with the output,
+    so an incremental run only reuses data parsed from the exact same body.
+    """
+    def __init__(self, base_url=DOTA_WIKI_URL, cache_directory=CACHE_DIRECTORY,
+                 concurrency=8, requests_per_second=10, retries=3) -> None:
+        self.base_url = base_url.rstrip('/')
+        self.cache_directory = pathlib.Path(cache_directory)
+        self.cache_directory.mkdir(parents=True, exist_ok=True)
+        # At most this many requests in flight.
+        self.semaphore = asyncio.Semaphore(concurrency)
+        # Minimum time between starting two requests.
+        self.interval = 1 / requests_per_second
+        self.next_request_time = 0
+        self.retries = retries
+        self.session = None
+        # URL -> sha1 of the page body, for this run and the one the previous output came from.
+        self.digests = {}
+        self.previous_digests = {}
+        # Counters for the summary.
+        self.downloaded = 0
+        self.not_modified = 0
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=0)
+        timeout = aiohttp.ClientTimeout(total=60)
+        headers = {'User-Agent': 'dotabot wiki scraper (https://github.com/plomdawg/discord-bot)'}
+        self.session = aiohttp.ClientSession(connector=connector, timeout=timeout, headers=headers)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+        print(f"Downloaded {self.downloaded} pages, {self.not_modified} were unchanged.")
+
+    def _cache_paths(self, url):
+        """ Returns the paths of the cached body and headers for a URL. """
+        key = hashlib.sha1(url.encode()).hexdigest()
+        return self.cache_directory / f"{key}.html", self.cache_directory / f"{key}.json"
+
+    def _cache_load(self, url):
+        """ Returns (headers, body) for a cached URL, or None. """
+        body_path, meta_path = self._cache_paths(url)
+        try:
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+            with open(body_path, 'r', encoding='utf-8') as f:
+                return meta, f.read()
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _cache_store(self, url, headers, body):
+        """ Caches a response, writing each file atomically. """
+        body_path, meta_path = self._cache_paths(url)
+        meta = {
+            'url': url,
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+        }
+        for path, content in ((body_path, body), (meta_path, json.dumps(meta))):
+            temp_path = path.with_name(f"{path.name}.part")
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write(content)
+            os.replace(temp_path, path)
+
+    async def _throttle(self):
+        """ Spaces out the start of requests. """
+        now = time.monotonic()
+        wait = self.next_request_time - now
+        self.next_request_time = max(now, self.next_request_time) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def fetch(self, url) -> str:
+        """ Returns the HTML of a page, from the cache if it hasn't changed. """
+        html, _ = await self.fetch_page(url)
+        return html
+
+    async def fetch_page(self, url) -> tuple:
+        """ Returns (html, modified) for a page. modified is False if the cached copy was still current. """
+        cached = self._cache_load(url)
+        headers = {}
+        if cached is not None:
+            meta, _ = cached
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        for attempt in range(1, self.retries + 1):
+            async with self.semaphore:
+                await self._throttle()
+                try:
+                    async with self.session.get(url, headers=headers) as response:
+                        if response.status == 304 and cached is not None:
+                            self.not_modified += 1
+                            self._record(url, cached[1])
+                            return cached[1], False
+                        # Back off when the wiki is busy.
+                        if response.status == 429 or response.status >= 500:
+                            raise aiohttp.ClientResponseError(
+                                response.request_info, response.history, status=response.status)
+                        response.raise_for_status()
+                        body = await response.text()
+                        break
+                except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                    # Pages that are missing or forbidden won't come back, only retry rate limits and server errors.
+                    if isinstance(error, aiohttp.ClientResponseError) and error.status != 429 and error.status < 500:
+                        raise
+                    if attempt == self.retries:
+                        raise
+                    print(f"Retrying {url} ({error})")
+            await asyncio.sleep(2 ** attempt)
+
+        print(f"Loaded: {url}")
+        self.downloaded += 1
+        self._cache_store(url, response.headers, body)
+        self._record(url, body)
+        return body, True
+
+    def _record(self, url, body):
+        """ Remembers the digest of a page's body. """
+        self.digests[url] = hashlib.sha1(body.encode('utf-8')).hexdigest()
+
+    def unchanged(self, url) -> bool:
+        """ Returns True if a fetched page has the same body the previous output was parsed from. """
+        return url in self.digests and self.digests[url] == self.previous_digests.get(url)
+
+
+async def parse(pool, function, *args):
+    """ Runs a parse function in the process pool, or right here if there isn't one. """
+    if pool is None:
+        return function(*args)
+    return await asyncio.get_running_loop().run_in_executor(pool, function, *args)
+
+
+#
+# Parse stage. These functions take the HTML of a page and return plain data,
+# so they can run in worker processes.
+#
+
+
+def parse_abilities(html, hero_url) -> list:
+    """ Returns the abilities on a hero's page. """
     abilities = []
 
-    # Dota wiki page that lists all abilities for a hero.
-    page = _load_page(hero.url)
+    page = BeautifulSoup(html, 'html.parser')
 
     # Find the ability elements on the page.
     for element in page.find_all(class_='ability-background'):
@@ -48,19 +205,20 @@ def get_abilities(hero) -> list:
             'name': name,
             'lore': lore,
             'thumbnail': thumbnail,
-            'url': f"{hero.url}#Abilities"
+            'url': f"{hero_url}#Abilities"
         }
         abilities.append(ability)
 
     return abilities
 
 
-def get_responses(hero) -> list:
-    """ Returns a list of Response objects for a Hero """
+def parse_responses_soup(html, parse_only=None) -> list:
+    """ Returns the responses on a Responses page, parsed with BeautifulSoup.
+        This is the original extractor, kept as the reference for bench_wiki_parse.py.
+    """
     responses = []
 
-    # Dota wiki page that lists all responses for a hero.
-    page = _load_page(f"{hero.url}/Responses")
+    page = BeautifulSoup(html, 'html.parser', parse_only=parse_only)
 
     # Find the main content on the page.
     content = page.find(class_='mw-parser-output')
@@ -102,6 +260,169 @@ def get_responses(hero) -> list:
     return responses
 
 
+def _soup_string(text) -> str:
+    """ Collapses a whitespace-only string to a newline or a space, like BeautifulSoup does. """
+    if text and not text.strip(' \n\t\f\r'):
+        return '\n' if '\n' in text else ' '
+    return text or ''
+
+
+def _text_without_spans(element) -> str:
+    """ Returns the text of an lxml element, leaving out <span>s and comments. """
+    parts = [_soup_string(element.text)]
+    for child in element:
+        # Comments have a function as their tag.
+        if isinstance(child.tag, str) and child.tag != 'span':
+            parts.append(_text_without_spans(child))
+        parts.append(_soup_string(child.tail))
+    return ''.join(parts)
+
+
+def parse_responses(html) -> list:
+    """ Returns the responses on a Responses page.
+
+    Walks an lxml tree of the page without building a BeautifulSoup tree or
+    decomposing anything. The output matches parse_responses_soup(). Without
+    lxml, falls back to BeautifulSoup, parsing only the main content.
+    """
+    if lxml_html is None:
+        return parse_responses_soup(html, parse_only=SoupStrainer(class_='mw-parser-output'))
+
+    responses = []
+
+    # Find the main content on the page.
+    content = lxml_html.fromstring(html).find_class('mw-parser-output')
+
+    # Skip pages that don't have content.
+    if not content:
+        return responses
+
+    # The original extractor decomposes every <span> in a response. Nested
+    # responses keep their audio inside a <span>, so they lose it and are skipped.
+    removed_audio = set()
+
+    for element in content[0].iter('li'):
+        # Ignore elements that don't contain an audio element.
+        audio_element = next((audio for audio in element.iter('audio') if audio not in removed_audio), None)
+        if audio_element is None:
+            continue
+
+        # Ignore elements that don't contain an audio link.
+        audio_source = next(audio_element.iter('source'), None)
+        if audio_source is None:
+            continue
+
+        for span in element.iter('span'):
+            removed_audio.update(span.iter('audio'))
+
+        responses.append({
+            'text': _text_without_spans(element).strip(),
+            'url': audio_source.get('src'),
+        })
+
+    return responses
+
+
+def parse_hero_list(html) -> list:
+    """ Returns (name, href) for every hero on the hero navigation page. """
+    page = BeautifulSoup(html, 'html.parser')
+
+    # Find the main content on the page.
+    content = page.find(class_='notanavbox-list notanavbox-odd')
+
+    # Replace escape code with space.
+    return [(element.text.replace('\xa0', ' '), element.get('href')) for element in content.find_all('a')]
+
+
+def parse_item_list(html, base_url) -> list:
+    """ Returns the name, gold cost, thumbnail and url of every item on the items page. """
+    items = []
+
+    page = BeautifulSoup(html, 'html.parser')
+
+    # Find the main content on the page.
+    content = page.find(class_='mw-parser-output')
+
+    # Remove stuff we do not need.
+    content.find(id='pageTabber').decompose()
+    content.find(id='toc').decompose()
+    content.find('p').decompose()
+
+    # Find all item lists on the page.
+    itemlist_elements = content.find_all(class_='itemlist')
+
+    # Find all items in the lists.
+    for itemlist in itemlist_elements:
+        for element in itemlist.find_all('div'):
+            # Grab the name from the list.
+            name = element.find_all('a')[1].text
+
+            # Check if the element has a gold cost.
+            gold_cost = element.find('span')
+            if gold_cost is not None:
+                gold_cost = int(gold_cost.text.strip())
+
+            # Extract the thumbnail and name from the element.
+            img = element.find('img')
+            thumbnail = img.get('data-src')
+            if thumbnail is None:
+                thumbnail = img.get('src')
+
+            url = f"{base_url}{element.find('a')['href']}"
+            items.append({
+                '_name': name,
+                'url': url,
+                'gold_cost': gold_cost,
+                'thumbnail': thumbnail,
+            })
+
+    return items
+
+
+def parse_item_lore(html) -> str:
+    """ Returns the lore on an item's page. """
+    page = BeautifulSoup(html, 'html.parser')
+
+    # Find the info box on the page.
+    info_box = page.find(class_='infobox')
+
+    # Load the lore text
+    lore = info_box.find('td', attrs={'style': 'font-style:italic; padding:6px 10px;'})
+
+    # Some items don't have lore.
+    if lore:
+      return lore.text.strip()
+    return "No lore found."
+
+
+#
+# Fetch stage. These coroutines download pages and hand them to the parse stage.
+#
+
+
+async def get_responses(fetcher, pool, hero, previous=None) -> list:
+    """ Returns a list of Response objects for a Hero.
+        Returns the previous responses instead if given and the page hasn't changed.
+    """
+    # Dota wiki page that lists all responses for a hero.
+    url = f"{hero.url}/Responses"
+    html = await fetcher.fetch(url)
+    if previous is not None and fetcher.unchanged(url):
+        return previous
+    return await parse(pool, parse_responses, html)
+
+
+async def get_abilities(fetcher, pool, hero, previous=None) -> list:
+    """ Returns a list of abilities for a Hero.
+        Returns the previous abilities instead if given and the page hasn't changed.
+    """
+    # Dota wiki page that lists all abilities for a hero.
+    html = await fetcher.fetch(hero.url)
+    if previous is not None and fetcher.unchanged(hero.url):
+        return previous
+    return await parse(pool, parse_abilities, html, hero.url)
+
+
 def get_thumbnail(hero) -> str:
     """ hard coding the thumbnails here """
     name = hero.name
@@ -136,22 +457,27 @@ def get_thumbnail(hero) -> str:
 
 
 class Hero:
-    def __init__(self, element) -> None:
+    def __init__(self, name, href, base_url=DOTA_WIKI_URL) -> None:
         # Hero name (e.g. 'Techies')
-        # Replace escape code with space.
-        self.name = element.text.replace('\xa0', ' ')
+        self.name = name
 
         # Dota wiki URL (e.g. 'https://dota2.fandom.com/wiki/Techies')
-        self.url = f"{DOTA_WIKI_URL}{element.get('href').replace('/Lore', '')}"
+        self.url = f"{base_url}{href.replace('/Lore', '')}"
 
         # Thumbnail URL.
         self.thumbnail = get_thumbnail(self)
 
-        # Load responses.
-        self.responses = get_responses(self)
+        # Responses and abilities are filled in by load().
+        self.responses = []
+        self.abilities = []
 
-        # Load abilities.
-        self.abilities = get_abilities(self)
+    async def load(self, fetcher, pool, previous=None) -> None:
+        """ Loads the responses and abilities, reusing the previous hero's data for unchanged pages. """
+        previous = previous or {}
+        self.responses, self.abilities = await asyncio.gather(
+            get_responses(fetcher, pool, self, previous.get('responses')),
+            get_abilities(fetcher, pool, self, previous.get('abilities')),
+        )
 
         print(
             f"{self.name} has {len(self.responses)} responses and {len(self.abilities)} abilities.")
@@ -166,20 +492,20 @@ class Hero:
         }
 
 
-def get_heroes() -> list:
-    """ Returns a list of Hero objects for all current heroes. """
+async def get_heroes(fetcher, pool, previous=None) -> list:
+    """ Returns a list of Hero objects for all current heroes.
+        previous maps hero names to their data from the last run, for incremental refreshes.
+    """
+    previous = previous or {}
     heroes = []
 
     # Dota wiki page that lists all heroes.
-    page = _load_page(f"{DOTA_WIKI_URL}/wiki/Template:Lore_nav/heroes")
+    html = await fetcher.fetch(f"{fetcher.base_url}/wiki/Template:Lore_nav/heroes")
 
-    # Find the main content on the page.
-    content = page.find(class_='notanavbox-list notanavbox-odd')
-
-    # Find all of the hero elements on the page.
-    for hero_element in content.find_all('a'):
+    # Find all of the heroes on the page.
+    for name, href in await parse(pool, parse_hero_list, html):
         # Create hero object.
-        hero = Hero(hero_element)
+        hero = Hero(name, href, base_url=fetcher.base_url)
 
         # Ignore hero variants (like "Terrorblade (Dragon's Blood)")
         if "(" in hero.name:
@@ -191,90 +517,163 @@ def get_heroes() -> list:
 
         heroes.append(hero)
 
+    # Load every hero's pages at once.
+    await asyncio.gather(*(hero.load(fetcher, pool, previous.get(hero.name)) for hero in heroes))
+
     return heroes
 
 
-def get_items() -> list:
-    """ Returns a list of Item objects for all current items. """
-    items = []
-
+async def get_item(fetcher, pool, item, previous=None) -> dict:
+    """ Adds the lore from an item's page to an item from the item list.
+        Reuses the previous item's lore if given and the page hasn't changed.
+    """
+    html = await fetcher.fetch(item['url'])
+    if previous is not None and fetcher.unchanged(item['url']):
+        lore = previous['lore']
+    else:
+        lore = await parse(pool, parse_item_lore, html)
+    # Keep the original key order.
+    item = {
+        '_name': item['_name'],
+        'url': item['url'],
+        'gold_cost': item['gold_cost'],
+        'lore': lore,
+        'thumbnail': item['thumbnail'],
+    }
+
+    print(f"Adding item {item['_name']} {item['gold_cost']} - {lore}")
+    return item
+
+
+async def get_items(fetcher, pool, previous=None) -> list:
+    """ Returns a list of Item objects for all current items.
+        previous maps item URLs to their data from the last run, for incremental refreshes.
+    """
+    previous = previous or {}
     # Dota wiki page that lists all items.
-    page = _load_page(f"{DOTA_WIKI_URL}/wiki/Items")
-
-    # Find the main content on the page.
-    content = page.find(class_='mw-parser-output')
-
-    # Remove stuff we do not need.
-    content.find(id='pageTabber').decompose()
-    content.find(id='toc').decompose()
-    content.find('p').decompose()
-
-    # Find all item lists on the page.
-    itemlist_elements = content.find_all(class_='itemlist')
-
-    # Find all items in the lists.
-    for itemlist in itemlist_elements:
-        for element in itemlist.find_all('div'):
-            # Grab the name from the list.
-            name = element.find_all('a')[1].text
-
-            # Check if the element has a gold cost.
-            gold_cost = element.find('span')
-            if gold_cost is not None:
-                gold_cost = int(gold_cost.text.strip())
-
-            # Extract the thumbnail and name from the element.
-            img = element.find('img')
-            thumbnail = img.get('data-src')
-            if thumbnail is None:
-                thumbnail = img.get('src')
-
-            # Load the item page.
-            url = f"{DOTA_WIKI_URL}{element.find('a')['href']}"
-            page = _load_page(url)
-
-            # Find the info box on the page.
-            info_box = page.find(class_='infobox')
-
-            # Load the lore text
-            lore = info_box.find('td', attrs={'style': 'font-style:italic; padding:6px 10px;'})
-
-            # Some items don't have lore.
-            if lore:
-              lore = lore.text.strip()
-            else:
-              lore = "No lore found."
-
-            item = {
-                '_name': name,
-                'url': url,
-                'gold_cost': gold_cost,
-                'lore': lore,
-                'thumbnail': thumbnail,
-            }
-
-            print(f"Adding item {name} {gold_cost} - {lore}")
-            items.append(item)
-
-    return items
+    html = await fetcher.fetch(f"{fetcher.base_url}/wiki/Items")
+    items = await parse(pool, parse_item_list, html, fetcher.base_url)
+
+    # Load the item pages at once.
+    return list(await asyncio.gather(*(get_item(fetcher, pool, item, previous.get(item['url'])) for item in items)))
+
+
+async def scrape(fetcher, pool=None, previous=None) -> dict:
+    """ Scrapes the heroes and items.
+
+    Pages are fetched concurrently and parsed in the process pool, if given.
+    gather() keeps the results in page order, so the output is the same
+    no matter which page finishes first.
+
+    If the previous data is given, pages whose body is the same as the one
+    it was parsed from (see 'pages') aren't parsed again.
+    """
+    data = {'heroes': [], 'items': [], 'pages': {}}
+    previous = previous or {'heroes': [], 'items': []}
+    fetcher.previous_digests = previous.get('pages', {})
+    previous_heroes = {hero['_name']: hero for hero in previous['heroes']}
+    previous_items = {item['url']: item for item in previous['items']}
+
+    # Get the items and heroes at the same time.
+    items, heroes = await asyncio.gather(
+        get_items(fetcher, pool, previous_items),
+        get_heroes(fetcher, pool, previous_heroes),
+    )
+    data['items'] = items
+    data['heroes'] = [hero.to_dict() for hero in heroes]
+    # The digest of every page the data was parsed from, for the next incremental run.
+    data['pages'] = dict(sorted(fetcher.digests.items()))
+    return data
+
+
+def diff_data(old, new) -> dict:
+    """ Returns what changed between two datasets. """
+    changelog = {}
+
+    # Heroes, by name.
+    old_heroes = {hero['_name'] for hero in old['heroes']}
+    new_heroes = {hero['_name'] for hero in new['heroes']}
+    changelog['heroes'] = {
+        'added': sorted(new_heroes - old_heroes),
+        'removed': sorted(old_heroes - new_heroes),
+    }
+
+    # Responses, by hero and audio URL.
+    def responses(data):
+        return {(hero['_name'], response['url']): response['text']
+                for hero in data['heroes'] for response in hero['responses']}
+    old_responses, new_responses = responses(old), responses(new)
+    changelog['responses'] = {
+        'added': [{'hero': hero, 'url': url, 'text': text}
+                  for (hero, url), text in new_responses.items() if (hero, url) not in old_responses],
+        'removed': [{'hero': hero, 'url': url, 'text': text}
+                    for (hero, url), text in old_responses.items() if (hero, url) not in new_responses],
+        'changed': [{'hero': hero, 'url': url, 'old_text': old_responses[(hero, url)], 'text': text}
+                    for (hero, url), text in new_responses.items()
+                    if (hero, url) in old_responses and old_responses[(hero, url)] != text],
+    }
+
+    # Items, by name.
+    old_items = {item['_name']: item for item in old['items']}
+    new_items = {item['_name']: item for item in new['items']}
+    changelog['items'] = {
+        'added': sorted(new_items.keys() - old_items.keys()),
+        'removed': sorted(old_items.keys() - new_items.keys()),
+        'changed': sorted(name for name in new_items.keys() & old_items.keys() if new_items[name] != old_items[name]),
+    }
+    return changelog
+
+
+def write_atomically(path, write) -> None:
+    """ Calls write(file) on a temporary file, then moves it into place so readers never see a partial file. """
+    temp_path = f"{path}.part"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        write(f)
+    os.replace(temp_path, path)
+
+
+async def main(args, previous=None) -> dict:
+    # Parsing is CPU bound, so spread it over every core.
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.processes) as pool:
+        async with WikiFetcher(base_url=args.base_url, cache_directory=args.cache_dir,
+                               concurrency=args.concurrency, requests_per_second=args.rate) as fetcher:
+            return await scrape(fetcher, pool, previous)
 
 
 if __name__ == "__main__":
-    # Convert list of heroes to yaml.
-    data = {'heroes': [], 'items': []}
+    parser = argparse.ArgumentParser(description="Scrape heroes, voice lines and items from the Dota 2 wiki.")
+    parser.add_argument('--base-url', default=os.environ.get('DOTA_WIKI_URL', DOTA_WIKI_URL),
+                        help="wiki to scrape, e.g. a local server of saved pages")
+    parser.add_argument('--cache-dir', default=CACHE_DIRECTORY, help="where to cache fetched pages")
+    parser.add_argument('--concurrency', type=int, default=8, help="maximum requests in flight")
+    parser.add_argument('--rate', type=float, default=10, help="maximum requests started per second")
+    parser.add_argument('--processes', type=int, default=None, help="parser processes (default: one per core)")
+    parser.add_argument('--incremental', action='store_true',
+                        help="only re-parse pages that changed since the last run")
+    args = parser.parse_args()
+
+    # Load the previous data, to diff against and to reuse in incremental mode.
+    try:
+        with open('dota_wiki.json', 'r') as json_file:
+            previous = json.load(json_file)
+    except FileNotFoundError:
+        previous = None
+
+    data = asyncio.run(main(args, previous if args.incremental else None))
 
-    # Get list of items.
-    data['items'] = get_items()
-
-    # Get list of heroes.
-    for hero in get_heroes():
-        data['heroes'].append(hero.to_dict())
-        
     # Export as yaml file.
-    with open('dota_wiki.yml', 'w') as yaml_file:
-        yaml.dump(data, yaml_file, default_flow_style=False, Dumper=Dumper,
-                  width=float("inf"))
-    
+    write_atomically('dota_wiki.yml', lambda yaml_file: yaml.dump(
+        data, yaml_file, default_flow_style=False, Dumper=Dumper, width=float("inf")))
+
     # Export as json file.
-    with open('dota_wiki.json', 'w') as json_file:
-        json.dump(data, json_file, indent=2)
+    write_atomically('dota_wiki.json', lambda json_file: json.dump(data, json_file, indent=2))
+
+    # Export the compact format the bot loads.
+    wiki_format.write(data, 'dota_wiki.bin')
+
+    # Export the changes since the last run.
+    if previous is not None:
+        changelog = diff_data(previous, data)
+        write_atomically('dota_wiki_changelog.json', lambda json_file: json.dump(changelog, json_file, indent=2))
+        for section, changes in changelog.items():
+            print(f"{section}: " + ", ".join(f"{len(names)} {change}" for change, names in changes.items()))
@@ -1,5 +1,7 @@
+import asyncio
 import logging
 import os
+import signal
 import sys
 
 import discord
@@ -47,6 +49,9 @@ class DotaBot(discord.Bot):
         self.invite_link = f"https://discord.com/api/oauth2/authorize?client_id={self.client_id}"
         self.invite_link += f"&permissions={self.permissions}&scope=bot%20applications.commands"
 
+        # Leave voice channels once everyone else has left.
+        self.voice_watcher = plomcord.IdleVoiceWatcher(self, seconds_to_wait=30)
+
         # Load cogs.
         self.load_extension('cogs.audio')
         self.load_extension('cogs.error_handler')
@@ -73,6 +78,10 @@ class DotaBot(discord.Bot):
             # Load the quiz now that the emojis are loaded.
             self.get_cog('ShopkeeperQuiz').load_words()
 
+            # Reload the wiki data on SIGHUP (e.g. after running dota_wiki.py).
+            if hasattr(signal, 'SIGHUP'):
+                self.loop.add_signal_handler(signal.SIGHUP, self.reload_wiki)
+
         @self.event
         async def on_guild_join(guild):
             # Try to find the #general channel to send first message.
@@ -87,7 +96,19 @@ class DotaBot(discord.Bot):
         @self.event
         async def on_voice_state_update(member, before, after):
             """ Called when a user changes their voice state. """
-            await plomcord.auto_disconnect(self, member.guild, seconds_to_wait=30)
+            self.voice_watcher.update(member.guild)
+
+    def reload_wiki(self):
+        """ Reloads the wiki data in the background. """
+        print("Got SIGHUP, reloading wiki data")
+        task = asyncio.ensure_future(self.get_cog('DotaWikiCog').reload())
+        task.add_done_callback(self.wiki_reloaded)
+
+    def wiki_reloaded(self, task):
+        """ Logs a failed background reload, since nothing else checks its result. """
+        if not task.cancelled() and task.exception() is not None:
+            logging.error("Failed to reload the wiki data, keeping the old data", exc_info=task.exception())
+
 
 def main():
     # Create the bot.
@@ -0,0 +1,57 @@
+""" Downloads voice lines into the audio cache ahead of time, so new hosts start warm.
+
+Run from the repository root:
+    python dota/prewarm.py                # every voice line
+    python dota/prewarm.py --top 500      # the 500 most played voice lines (see most_played_urls)
+    python dota/prewarm.py --normalize    # also transcode to Opus
+
+Interrupted runs can simply be restarted; cached voice lines are skipped.
+"""
+import argparse
+import asyncio
+import json
+import sys
+
+# hacky way to import the shared cogs
+sys.path.append(".")
+from cogs import audio
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prewarm the voice line audio cache.")
+    parser.add_argument("--top", type=int, help="only fetch the N most played voice lines")
+    parser.add_argument("--normalize", action="store_true", help="also normalize and transcode to Opus")
+    parser.add_argument("--concurrency", type=int, default=8, help="number of downloads at once")
+    parser.add_argument("--wiki", default="dota/dota_wiki.json", help="path to the scraped wiki data")
+    args = parser.parse_args()
+
+    # Collect every voice line URL.
+    with open(args.wiki, "r") as f:
+        data = json.load(f)
+    urls = [response["url"] for hero in data["heroes"] for response in hero["responses"]]
+
+    async def run():
+        downloader = audio.AudioDownloader()
+        cache = audio.AudioCache()
+        transcoder = audio.AudioTranscoder(cache) if args.normalize else None
+
+        selected = urls
+        if args.top is not None:
+            selected = audio.most_played_urls(urls, cache, args.top)
+
+        def progress(counts):
+            done = counts["skipped"] + counts["fetched"] + counts["failed"]
+            print(f"\r{done}/{counts['total']} ({counts['failed']} failed)", end="", flush=True)
+
+        try:
+            counts = await audio.prewarm(selected, downloader, cache, transcoder=transcoder,
+                                         concurrency=args.concurrency, progress=progress)
+        finally:
+            await downloader.close()
+        print(f"\nFetched {counts['fetched']}, skipped {counts['skipped']}, failed {counts['failed']}.")
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+""" A compact binary format for the scraped wiki data.
+
+dota_wiki.py writes it next to dota_wiki.json, and the wiki cog memory maps it
+instead of parsing the json. Every string is stored once in a string table and
+the records only hold indexes into it, so loading is a handful of array views
+and strings are only decoded when they're used.
+
+Layout (little endian, every section is an array of u32 except the blob):
+    header      magic, version, counts and the sha256 of the rest of the file
+    offsets     string_count + 1 offsets into the blob
+    heroes      name, url, thumbnail, first ability, last ability, first response, last response
+    abilities   name, lore, thumbnail, url
+    responses   text, url
+    items       name, gold cost, lore, thumbnail, url
+    blob        every string, utf-8 encoded, back to back
+"""
+import array
+import hashlib
+import mmap
+import os
+import struct
+import sys
+
+MAGIC = b"DOTAWIKI"
+VERSION = 1
+HEADER = struct.Struct("<8sI5I32s")
+
+# Marks a missing string or gold cost.
+NONE = 0xFFFFFFFF
+
+HERO_FIELDS = 7
+ABILITY_FIELDS = 4
+RESPONSE_FIELDS = 2
+ITEM_FIELDS = 5
+
+
+def encode(data) -> bytes:
+    """ Encodes the scraped wiki data (the dict saved as dota_wiki.json). """
+    strings = {}
+    blob = bytearray()
+    offsets = array.array("I", [0])
+
+    def string(value):
+        """ Returns the index of a string in the string table, adding it if needed. """
+        if value is None:
+            return NONE
+        if value not in strings:
+            strings[value] = len(strings)
+            blob.extend(value.encode("utf-8"))
+            offsets.append(len(blob))
+        return strings[value]
+
+    heroes = array.array("I")
+    abilities = array.array("I")
+    responses = array.array("I")
+    for hero in data["heroes"]:
+        first_ability = len(abilities) // ABILITY_FIELDS
+        for ability in hero["abilities"]:
+            abilities.extend((string(ability["name"]), string(ability["lore"]),
+                              string(ability["thumbnail"]), string(ability["url"])))
+        first_response = len(responses) // RESPONSE_FIELDS
+        for response in hero["responses"]:
+            responses.extend((string(response["text"]), string(response["url"])))
+        heroes.extend((string(hero["_name"]), string(hero["url"]), string(hero["thumbnail"]),
+                       first_ability, len(abilities) // ABILITY_FIELDS,
+                       first_response, len(responses) // RESPONSE_FIELDS))
+
+    items = array.array("I")
+    for item in data["items"]:
+        cost = NONE if item["gold_cost"] is None else item["gold_cost"]
+        items.extend((string(item["_name"]), cost, string(item["lore"]),
+                      string(item["thumbnail"]), string(item["url"])))
+
+    # The format is little endian on disk.
+    sections = [offsets, heroes, abilities, responses, items]
+    if sys.byteorder == "big":
+        for section in sections:
+            section.byteswap()
+    body = b"".join(section.tobytes() for section in sections) + bytes(blob)
+
+    header = HEADER.pack(MAGIC, VERSION, len(strings), len(heroes) // HERO_FIELDS,
+                         len(abilities) // ABILITY_FIELDS, len(responses) // RESPONSE_FIELDS,
+                         len(items) // ITEM_FIELDS, hashlib.sha256(body).digest())
+    return header + body
+
+
+def write(data, path) -> None:
+    """ Encodes the wiki data to a file, atomically. """
+    temp_path = f"{path}.part"
+    with open(temp_path, "wb") as f:
+        f.write(encode(data))
+    os.replace(temp_path, path)
+
+
+class WikiFile:
+    """ A memory mapped wiki data file. Strings are decoded when they're read. """
+
+    def __init__(self, path) -> None:
+        with open(path, "rb") as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, string_count, hero_count, ability_count, response_count, item_count, digest = \
+            HEADER.unpack_from(self.mmap)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} wiki data file")
+
+        # Fingerprint of the data, stored in the header so the whole file doesn't need to be read.
+        self.checksum = digest.hex()
+
+        position = HEADER.size
+
+        def section(count):
+            """ Returns the next u32 array in the file. """
+            nonlocal position
+            start, position = position, position + count * 4
+            if sys.byteorder == "big":
+                values = array.array("I", self.mmap[start:position])
+                values.byteswap()
+                return values
+            return memoryview(self.mmap)[start:position].cast("I")
+
+        self.offsets = section(string_count + 1)
+        self.hero_table = section(hero_count * HERO_FIELDS)
+        self.ability_table = section(ability_count * ABILITY_FIELDS)
+        self.response_table = section(response_count * RESPONSE_FIELDS)
+        self.item_table = section(item_count * ITEM_FIELDS)
+        self.blob = position
+
+        self.hero_count = hero_count
+        self.item_count = item_count
+
+    def string(self, index):
+        """ Returns a string from the string table. """
+        if index == NONE:
+            return None
+        start = self.blob + self.offsets[index]
+        end = self.blob + self.offsets[index + 1]
+        return self.mmap[start:end].decode("utf-8")
+
+    def hero(self, index) -> dict:
+        """ Returns a hero in the same shape as dota_wiki.json. """
+        name, url, thumbnail, first_ability, last_ability, first_response, last_response = \
+            self.hero_table[index * HERO_FIELDS:(index + 1) * HERO_FIELDS]
+        return {
+            "_name": self.string(name),
+            "url": self.string(url),
+            "thumbnail": self.string(thumbnail),
+            "abilities": [self.ability(i) for i in range(first_ability, last_ability)],
+            "responses": self.responses(first_response, last_response),
+        }
+
+    def ability(self, index) -> dict:
+        """ Returns an ability in the same shape as dota_wiki.json. """
+        name, lore, thumbnail, url = self.ability_table[index * ABILITY_FIELDS:(index + 1) * ABILITY_FIELDS]
+        return {
+            "name": self.string(name),
+            "lore": self.string(lore),
+            "thumbnail": self.string(thumbnail),
+            "url": self.string(url),
+        }
+
+    def response(self, index) -> dict:
+        """ Returns a voice response in the same shape as dota_wiki.json. """
+        text, url = self.response_table[index * RESPONSE_FIELDS:(index + 1) * RESPONSE_FIELDS]
+        return {"text": self.string(text), "url": self.string(url)}
+
+    def responses(self, first, last) -> list:
+        """ Returns a range of voice responses. Faster than calling response() for each one. """
+        table = self.response_table[first * RESPONSE_FIELDS:last * RESPONSE_FIELDS].tolist()
+        string = self.string
+        return [{"text": string(text), "url": string(url)} for text, url in zip(table[::2], table[1::2])]
+
+    def item(self, index) -> dict:
+        """ Returns an item in the same shape as dota_wiki.json. """
+        name, cost, lore, thumbnail, url = self.item_table[index * ITEM_FIELDS:(index + 1) * ITEM_FIELDS]
+        return {
+            "_name": self.string(name),
+            "gold_cost": None if cost == NONE else cost,
+            "lore": self.string(lore),
+            "thumbnail": self.string(thumbnail),
+            "url": self.string(url),
+        }
+
+    def heroes(self):
+        """ Yields every hero, one at a time. """
+        for index in range(self.hero_count):
+            yield self.hero(index)
+
+    def items(self):
+        """ Yields every item, one at a time. """
+        for index in range(self.item_count):
+            yield self.item(index)
+
+    def close(self) -> None:
+        """ Releases the memory map. """
+        # The views have to be released before the map can be closed.
+        for table in (self.offsets, self.hero_table, self.ability_table, self.response_table, self.item_table):
+            if isinstance(table, memoryview):
+                table.release()
+        self.mmap.close()
@@ -3,4 +3,8 @@ from .plomcord import auto_disconnect
 from .plomcord import set_activity
 from .plomcord import send_embed
 from .plomcord import add_reactions
-from .plomcord import delete_message
\ No newline at end of file
+from .plomcord import delete_message
+from .plomcord import chunk_text
+from .scheduler import OutboundScheduler
+from .scheduler import scheduler
+from .voice_watcher import IdleVoiceWatcher
@@ -4,6 +4,8 @@ import random
 import logging
 import asyncio
 
+from .scheduler import scheduler
+
 def on_ready_info(bot):
     """ Prints information about the bot when it connects to Discord servers. """
     logging.info(
@@ -72,13 +74,12 @@ async def auto_disconnect(bot, guild, seconds_to_wait=60):
     await audio_player.stop()
 
 async def add_reactions(message, emojis):
-    """ Adds emojis to a message, ignoring NotFound errors """
-    logging.debug(f"add_reactions({message.id}, {emojis})")
+    """ Adds emojis to a message, ignoring NotFound errors. Paced by the outbound scheduler. """
     if message is not None:
+        logging.debug(f"add_reactions({message.id}, {emojis})")
         try:
             for emoji in emojis:
-                await message.add_reaction(emoji)
-                await asyncio.sleep(0.1)
+                await scheduler.add_reaction(message, emoji)
         except discord.errors.NotFound:
             return
 
@@ -119,104 +120,125 @@ async def set_activity(bot, activity: str):
         # Set the activity.
         await bot.change_presence(activity=discord.Activity(name=activity, type=activity_type))
 
+# Discord's embed limits.
+EMBED_TITLE_LIMIT = 256
+EMBED_DESCRIPTION_LIMIT = 4096
+EMBED_FIELD_NAME_LIMIT = 256
+EMBED_FIELD_VALUE_LIMIT = 1024
+EMBED_FOOTER_LIMIT = 2048
+EMBED_TOTAL_LIMIT = 6000  # characters in one embed, and across every embed in one message
+EMBEDS_PER_MESSAGE = 10
+
+def split_line(line, limit):
+    """ Yields pieces of a line at most limit characters long, split between words where possible. """
+    start = 0
+    while len(line) - start > limit:
+        # Break at the last space that fits, or mid-word if there isn't one.
+        cut = line.rfind(" ", start + 1, start + limit + 1)
+        if cut == -1:
+            yield line[start:start + limit]
+            start += limit
+        else:
+            yield line[start:cut]
+            start = cut + 1
+    yield line[start:]
+
+def chunk_text(text, limit=EMBED_DESCRIPTION_LIMIT):
+    """ Yields pages of text at most limit characters long, split between lines, or between words for long lines.
+        Runs in linear time, so it's fine for very long text. """
+    chunk = []
+    length = 0
+    for line in text.split("\n"):
+        for piece in split_line(line, limit):
+            # Start a new page if this piece (and its newline) doesn't fit.
+            if chunk and length + 1 + len(piece) > limit:
+                page = "\n".join(chunk).strip("\n")
+                if page.strip():
+                    yield page
+                chunk = []
+            # Don't start a page with a blank line.
+            if not chunk and not piece:
+                continue
+            length = length + 1 + len(piece) if chunk else len(piece)
+            chunk.append(piece)
+    page = "\n".join(chunk).strip("\n")
+    if page.strip():
+        yield page
+
+def embed_batches(embeds):
+    """ Groups embeds into messages, keeping within the embeds and characters allowed per message. """
+    batch = []
+    size = 0
+    for embed in embeds:
+        if batch and (len(batch) == EMBEDS_PER_MESSAGE or size + len(embed) > EMBED_TOTAL_LIMIT):
+            yield batch
+            batch = []
+            size = 0
+        batch.append(embed)
+        size += len(embed)
+    if batch:
+        yield batch
+
 async def send_embed(channel, color=None, footer=None, footer_icon=None, subtitle=None,
                         subtext=None, text=None, title=None, thumbnail=None):
     """ Sends a message to a channel, and returns the discord.Message of the sent message.
 
-    If the text is over 2048 characters, subtitle and subtext fields are ignored and the
-    message is split up into chunks. The first message will have the title and thumbnail,
-    and only the last message will have the footer. Returns the last message sent.
+    If the text is too long for one embed it's split into pages, which are sent
+    up to 10 embeds per message. The first embed has the title, thumbnail and
+    subtitle/subtext field, and only the last one has the footer. Returns the
+    last message sent.
     """
-    MAX_MSG_LENGTH = 2048
-
     # Use a random color if none was given
     if color is None:
         color = random.randint(0, 0xFFFFFF)
 
-    # If the text is short enough to fit into one message,
-    # create and send a single embed.
-    if text is None or len(text) <= MAX_MSG_LENGTH:
+    # Keep the title, field and footer within their limits.
+    if title is not None:
+        title = title[:EMBED_TITLE_LIMIT]
+    if subtitle is not None:
+        subtitle = subtitle[:EMBED_FIELD_NAME_LIMIT]
+    if subtext is not None:
+        subtext = subtext[:EMBED_FIELD_VALUE_LIMIT]
+    if footer is not None:
+        footer = footer[:EMBED_FOOTER_LIMIT]
+
+    # Make an embed for each page of text. Pages are kept short enough that an embed
+    # with the title, field and footer all on it still fits in the total limit.
+    extras = sum(len(part) for part in (title, subtitle, subtext, footer) if part is not None)
+    limit = min(EMBED_DESCRIPTION_LIMIT, EMBED_TOTAL_LIMIT - extras)
+    # Blank text still gets one (empty) embed.
+    pages = list(chunk_text(text, limit)) if text else []
+    pages = pages or [None]
+    embeds = []
+    for page in pages:
         embed = discord.Embed(color=color)
-        if footer is not None:
-            if footer_icon is None:
-                embed.set_footer(text=footer)
-            else:
-                embed.set_footer(text=footer, icon_url=footer_icon)
-        if subtitle is not None or subtext is not None:
-            embed.add_field(name=subtitle, value=subtext, inline=True)
-        if thumbnail is not None:
-            embed.set_thumbnail(url=thumbnail)
-        if title is not None:
-            embed.title = title
-        if text is not None:
-            embed.description = text
-
+        embed.description = page
+        embeds.append(embed)
+
+    # First embed - add the title, thumbnail and field.
+    first = embeds[0]
+    if title is not None:
+        first.title = title
+    if thumbnail is not None:
+        first.set_thumbnail(url=thumbnail)
+    if subtitle is not None or subtext is not None:
+        first.add_field(name=subtitle, value=subtext, inline=True)
+
+    # Last embed - add the footer.
+    if footer is not None:
+        if footer_icon is not None:
+            embeds[-1].set_footer(text=footer, icon_url=footer_icon)
+        else:
+            embeds[-1].set_footer(text=footer)
+
+    response = None
+    for batch in embed_batches(embeds):
         # If this is a ctx, use respond() so the command succeeds and doesn't
         # print "This interaction failed" to the user.
         if type(channel) == discord.commands.context.ApplicationContext:
-            response = await channel.respond(embed=embed)
-            logging.debug(f"send_embed() -> {response}")
-            return
-
-        # Send the single message
-        return await channel.send(embed=embed)
-
-    # If the text is too long, it must be broken into chunks.
-    message_index = 0
-    lines = text.split("\n")
-    while lines:
-        # Construct the text of this message
-        text = ""
-        while True:
-            if not lines:
-                break
-            line = lines.pop(0) + '\n'
-
-            # next line fits in this message, add it
-            if len(text) + len(line) < MAX_MSG_LENGTH:
-                text += line
-
-            # one line is longer than max length of message, split the line and put the rest back
-            elif len(line) > MAX_MSG_LENGTH:
-                cutoff = MAX_MSG_LENGTH - len(text)
-                next_line = line[:cutoff]
-                remainder = line[cutoff:-1]
-                text += next_line
-                lines.insert(0, remainder)
-            # message is full - send it
-            else:
-                lines.insert(0, line)
-                break
-
-        embed = discord.Embed(color=color)
-        embed.description = text
-
-        # First message in chain - add the title and thumbnail
-        if message_index == 0:
-            if title is not None:
-                embed.title = title
-            if thumbnail is not None:
-                embed.set_thumbnail(url=thumbnail)
-            if subtitle is not None or subtext is not None:
-                embed.add_field(name=subtitle, value=subtext, inline=True)
-            response = await channel.send(embed=embed)
-
-        # Last message in chain - add the footer.
-        if not lines:
-            if footer is not None:
-                if footer_icon is not None:
-                    embed.set_footer(text=footer, icon_url=footer_icon)
-                else:
-                    embed.set_footer(text=footer)
-
-            # If this is a ctx, use respond() so the command succeeds and doesn't
-            # print "This interaction failed" to the user.
-            if type(channel) == discord.commands.context.ApplicationContext:
-                response = await channel.respond(embed=embed)
-            else:
-                response = await channel.send(embed=embed)
-
-        message_index = message_index + 1
+            response = await channel.respond(embeds=batch)
+        else:
+            response = await scheduler.send(channel, embeds=batch)
 
     # Return the last message sent so reactions can be easily added
     logging.debug(f"send_embed() -> {response}")
@@ -0,0 +1,172 @@
+# Paces outgoing Discord requests so bots stay under the rate limits.
+import asyncio
+import collections
+import time
+
+# Known Discord limits, per channel: (requests, per seconds).
+ROUTE_LIMITS = {
+    "send": (5, 5.0),
+    "edit": (5, 5.0),
+    "reaction": (1, 0.25),
+}
+
+# Requests per second across every route.
+GLOBAL_LIMIT = (50, 1.0)
+
+
+class TokenBucket:
+    """ Allows a number of requests per period, refilling continuously. """
+
+    def __init__(self, requests, seconds) -> None:
+        self.capacity = requests
+        self.rate = requests / seconds
+        self.tokens = requests
+        self.updated = time.monotonic()
+
+    def refill(self) -> None:
+        """ Adds the tokens earned since the last refill. """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self) -> bool:
+        """ Uses up a request if one is allowed right now. Returns False instead of waiting. """
+        self.refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    async def acquire(self) -> None:
+        """ Waits until a request is allowed, then uses it up. """
+        while not self.try_acquire():
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Job:
+    """ A queued request, and everyone waiting on its result. """
+    __slots__ = ("call", "futures", "queued")
+
+    def __init__(self, call, future) -> None:
+        self.call = call
+        self.futures = [future]
+        self.queued = time.monotonic()
+
+
+class OutboundScheduler:
+    """ Queues sends, edits and reactions per route (kind of request and channel), and runs
+        each queue in order at the pace Discord allows. Pending edits of the same message
+        are coalesced, so only the latest content is sent.
+    """
+
+    def __init__(self) -> None:
+        # Route -> OrderedDict of key -> Job.
+        self.queues = {}
+        # Route -> TokenBucket. Idle, full buckets are pruned once there are prune_at of them.
+        self.buckets = {}
+        self.prune_at = 64
+        # Route -> task running its queue.
+        self.workers = {}
+        self.global_bucket = TokenBucket(*GLOBAL_LIMIT)
+
+        # Metrics.
+        self.sent = 0
+        self.coalesced = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def submit(self, kind, channel_id, call, key=None) -> asyncio.Future:
+        """ Queues call() on the route for this kind and channel, and returns a future for its result.
+            Jobs with the same key replace a pending one instead of queueing another request.
+        """
+        route = (kind, channel_id)
+        future = asyncio.get_running_loop().create_future()
+        queue = self.queues.setdefault(route, collections.OrderedDict())
+
+        # Replace a pending job with the same key. Its callers get the new result.
+        if key is not None and key in queue:
+            job = queue[key]
+            job.call = call
+            job.futures.append(future)
+            self.coalesced += 1
+        else:
+            queue[key if key is not None else object()] = Job(call, future)
+
+        # Start a worker for the route if it doesn't have one.
+        if route not in self.workers:
+            self.workers[route] = asyncio.ensure_future(self.run(route))
+        return future
+
+    async def run(self, route) -> None:
+        """ Runs the jobs queued on a route, one at a time. """
+        queue = self.queues[route]
+        bucket = self.buckets.get(route)
+        if bucket is None:
+            # Prune before adding, doubling the threshold so pruning stays amortized O(1) per route.
+            if len(self.buckets) >= self.prune_at:
+                self.prune()
+                self.prune_at = max(64, 2 * len(self.buckets))
+            bucket = self.buckets[route] = TokenBucket(*ROUTE_LIMITS[route[0]])
+        try:
+            while queue:
+                await bucket.acquire()
+                await self.global_bucket.acquire()
+                _, job = queue.popitem(last=False)
+
+                # Track how long requests wait to go out.
+                wait = time.monotonic() - job.queued
+                self.sent += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+
+                try:
+                    result = await job.call()
+                except Exception as e:
+                    for future in job.futures:
+                        if not future.done():
+                            future.set_exception(e)
+                else:
+                    for future in job.futures:
+                        if not future.done():
+                            future.set_result(result)
+        finally:
+            del self.workers[route]
+            if not queue:
+                del self.queues[route]
+
+    def send(self, channel, **kwargs) -> asyncio.Future:
+        """ Sends a message to a channel. """
+        return self.submit("send", channel.id, lambda: channel.send(**kwargs))
+
+    def edit(self, message, **kwargs) -> asyncio.Future:
+        """ Edits a message. If an edit of it is still queued, that edit is replaced by this one. """
+        return self.submit("edit", message.channel.id, lambda: message.edit(**kwargs), key=message.id)
+
+    def add_reaction(self, message, emoji) -> asyncio.Future:
+        """ Adds a reaction to a message. """
+        return self.submit("reaction", message.channel.id, lambda: message.add_reaction(emoji))
+
+    def prune(self) -> None:
+        """ Drops the buckets of idle routes that have refilled. A new one would start out the same. """
+        for route, bucket in list(self.buckets.items()):
+            if route in self.workers:
+                continue
+            bucket.refill()
+            if bucket.tokens >= bucket.capacity:
+                del self.buckets[route]
+
+    def metrics(self) -> dict:
+        """ Returns the queue depth per route and wait times so far. """
+        self.prune()
+        metrics = {
+            "queued": {f"{kind}:{channel_id}": len(queue) for (kind, channel_id), queue in self.queues.items()},
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "average_wait": self.total_wait / self.sent if self.sent else 0.0,
+            "max_wait": self.max_wait,
+        }
+        return metrics
+
+
+# Shared by everything in the bot, so all requests count against the same limits.
+scheduler = OutboundScheduler()
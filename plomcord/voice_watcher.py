@@ -0,0 +1,91 @@
+# Disconnects from voice channels the bot has been left alone in.
+import asyncio
+import logging
+import math
+
+
+class IdleVoiceWatcher:
+    """ Leaves and clears the queue in guilds where the bot is alone in a voice channel.
+
+    Call update(guild) on every voice state update. Each guild has at most one
+    timer, and all timers live in a timer wheel: a ring of slots, one per tick,
+    turned by a single task that only runs while there are timers. Scheduling,
+    cancelling and expiring a timer are all O(1), however many guilds there are.
+    """
+
+    def __init__(self, bot, seconds_to_wait=60, tick=1.0) -> None:
+        self.bot = bot
+        self.tick = tick
+        # Ticks until a timer expires.
+        self.delay = max(1, math.ceil(seconds_to_wait / tick))
+        # One more slot than the delay, so a new timer never lands on the current slot.
+        self.slots = [set() for _ in range(self.delay + 1)]
+        self.cursor = 0
+        # Guild id -> (slot, id of the channel the bot was alone in).
+        self.timers = {}
+        self.task = None
+
+    def update(self, guild) -> None:
+        """ Starts, keeps or cancels the guild's timer based on who's in the bot's voice channel. """
+        voice_client = guild.voice_client
+
+        # Nothing to wait for if the bot isn't connected, or isn't alone.
+        if voice_client is None or any(not user.bot for user in voice_client.channel.members):
+            self.cancel(guild.id)
+            return
+
+        # Keep the running timer unless the bot moved to another channel.
+        timer = self.timers.get(guild.id)
+        if timer is not None and timer[1] == voice_client.channel.id:
+            return
+        self.cancel(guild.id)
+        self.schedule(guild.id, voice_client.channel.id)
+
+    def schedule(self, guild_id, channel_id) -> None:
+        """ Starts a timer for a guild. """
+        slot = (self.cursor + self.delay) % len(self.slots)
+        self.slots[slot].add(guild_id)
+        self.timers[guild_id] = (slot, channel_id)
+
+        # Start turning the wheel if it's stopped.
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+
+    def cancel(self, guild_id) -> None:
+        """ Cancels a guild's timer, if it has one. """
+        timer = self.timers.pop(guild_id, None)
+        if timer is not None:
+            self.slots[timer[0]].discard(guild_id)
+
+    async def run(self) -> None:
+        """ Turns the wheel once per tick, expiring the timers in each slot, until there are no timers left. """
+        try:
+            while self.timers:
+                await asyncio.sleep(self.tick)
+                self.cursor = (self.cursor + 1) % len(self.slots)
+                expired = self.slots[self.cursor]
+                self.slots[self.cursor] = set()
+                for guild_id in expired:
+                    _, channel_id = self.timers.pop(guild_id)
+                    asyncio.ensure_future(self.expire(guild_id, channel_id))
+        finally:
+            self.task = None
+
+    async def expire(self, guild_id, channel_id) -> None:
+        """ Leaves the guild's voice channel if the bot is still alone in the same channel. """
+        guild = self.bot.get_guild(guild_id)
+        if guild is None:
+            return
+        voice_client = guild.voice_client
+
+        # Check if the bot has been disconnected or moved to a different channel.
+        if voice_client is None or not voice_client.is_connected() or voice_client.channel.id != channel_id:
+            return
+
+        # Check if a non-bot has joined the channel.
+        if any(not user.bot for user in voice_client.channel.members):
+            return
+
+        logging.info(f"Leaving voice in {guild.name} after being alone")
+        audio_player = self.bot.audio.get_audio_player(guild.id)
+        await audio_player.stop()